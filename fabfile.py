@@ -72,8 +72,9 @@ def makemigrations():
 
 
 def migrate():
-    """Run Django's migrate"""
+    """Run Django's migrate, and create the database cache table if it doesn't exist yet"""
     local(_dcmd("python3 manage.py migrate"))
+    local(_dcmd("python3 manage.py createcachetable"))
 
 
 def shell_plus():
@@ -22,6 +22,7 @@ class SuitConfig(DjangoSuitConfig):
             ChildItem(model='sdr.defaccuracylocation'),
             ChildItem(model='sdr.defaccuracysize'),
             ChildItem(model='sdr.defrectification'),
+            ChildItem(model='sdr.processingtask'),
         ], icon='fa fa-map'),
         ParentItem('Places', children=[
             ChildItem(model='pn.place'),
@@ -44,6 +45,10 @@ class SuitConfig(DjangoSuitConfig):
             ChildItem(model='base.reference'),
             ChildItem(model='base.period'),
         ]),
+        ParentItem('Exports', children=[
+            ChildItem(model='exports.exportjob'),
+            ChildItem(model='exports.exportcache'),
+        ], icon='fa fa-download'),
         ParentItem('Users', children=[
             ChildItem(model='auth.user'),
             ChildItem('User groups', 'auth.group'),
@@ -73,3 +78,8 @@ class SpeciesAppConfig(AppConfig):
 class MuirwebConfig(AppConfig):
     name = 'muirweb'
     verbose_name = 'Muir Web'
+
+
+class ExportsAppConfig(AppConfig):
+    name = 'exports'
+    verbose_name = 'Exports'
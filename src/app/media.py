@@ -0,0 +1,82 @@
+import mimetypes
+import posixpath
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import PermissionDenied
+from django.core.files.storage import default_storage
+from django.core.urlresolvers import reverse
+from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.utils.http import urlquote
+from django.views.static import serve
+from app.storage import is_s3_storage, presigned_url
+from exports.models import ExportJob, ExportCache
+from sdr.models import Scan, Georef, Feature, UploadSession
+
+
+def media_url(name):
+    """Link to the stored file name through serve_media, rather than straight to storage."""
+    return reverse('media', args=(name,))
+
+
+def sdr_file_models(name):
+    """
+    Scan/Georef/Feature models with a record whose file or COG is stored at name. Thumbnails and tiles aren't looked
+    up by name: they're served by the SDR admin's tiles view, which knows the record they belong to.
+    """
+    found = set(model for model in (Scan, Georef, Feature) if model.objects.filter(file=name).exists())
+    if Georef.objects.filter(cog=name).exists():
+        found.add(Georef)
+    return found
+
+
+def change_permission(model):
+    return '%s.change_%s' % (model._meta.app_label, model._meta.model_name)
+
+
+def media_permitted(user, name):
+    """
+    Whether user may download the stored file name: SDR files and COGs need change permission on a model that
+    references them, exports and uploads belong to whoever created them. Files nothing references are
+    only served to superusers.
+    """
+    if user.is_superuser:
+        return True
+    if name.startswith('uploads/'):
+        return UploadSession.objects.filter(name=name, created_by=user).exists()
+    if name.startswith('exports/'):
+        if user.has_perm(change_permission(ExportJob)):
+            return ExportJob.objects.filter(file=name).exists() or ExportCache.objects.filter(file=name).exists()
+        return ExportJob.objects.filter(file=name, created_by=user).exists()
+    return any(user.has_perm(change_permission(model)) for model in sdr_file_models(name))
+
+
+def media_response(request, name, storage=None):
+    """
+    Hand the transfer of a stored file off so the worker is freed at once: to nginx with X-Accel-Redirect
+    (MEDIA_ACCEL_REDIRECT, an internal location aliased to MEDIA_ROOT), or to a presigned url for S3 storage.
+    Without MEDIA_ACCEL_REDIRECT (e.g. runserver) Django serves the file itself. Permissions are the caller's job.
+    """
+    storage = storage or default_storage
+    if is_s3_storage(storage):
+        return HttpResponseRedirect(presigned_url(name, storage))
+    if not storage.exists(name):
+        raise Http404('No such file')
+    if settings.MEDIA_ACCEL_REDIRECT:
+        content_type, encoding = mimetypes.guess_type(name)
+        response = HttpResponse(content_type=content_type or 'application/octet-stream')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['X-Accel-Redirect'] = '%s%s' % (settings.MEDIA_ACCEL_REDIRECT, urlquote(name))
+        return response
+    return serve(request, name, document_root=settings.MEDIA_ROOT)
+
+
+@staff_member_required
+def serve_media(request, path):
+    """Media downloads, after a permission check (see media_permitted and media_response)."""
+    name = posixpath.normpath(path).lstrip('/')
+    if name.startswith('..') or name != path:
+        raise Http404('Invalid path')
+    if not media_permitted(request.user, name):
+        raise PermissionDenied
+    return media_response(request, name)
@@ -68,6 +68,7 @@ INSTALLED_APPS = [
     'pn',
     'species',
     'muirweb',
+    'exports',
     'tools',
     'debug_toolbar',
 ]
@@ -122,6 +123,17 @@ DATABASES = {
 }
 
 
+# Cache shared by all gunicorn workers and the background worker, so signal-based invalidation reaches every process
+# https://docs.djangoproject.com/en/1.11/topics/cache/#database-caching
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'sdr_cache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 
@@ -165,7 +177,20 @@ AWS_REGION = os.environ.get('AWS_REGION')
 AWS_BACKUP_BUCKET = os.environ.get('AWS_BACKUP_BUCKET')
 AWS_STORAGE_BUCKET_NAME = os.environ.get('AWS_STORAGE_BUCKET_NAME')
 AWS_S3_CUSTOM_DOMAIN = '%s.s3.amazonaws.com' % AWS_STORAGE_BUCKET_NAME
+# S3-compatible stand-in (e.g. the sdr_s3 minio service in docker-compose.yml) for offline testing and benchmarks
+AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL')
+# Largest file accepted by the resumable (chunked) upload endpoints
+RESUMABLE_UPLOAD_MAX_SIZE = int(os.environ.get('RESUMABLE_UPLOAD_MAX_SIZE', 50 * 1024 ** 3))
+# Store SDR files once per distinct content, under cas/<content hash>, shared by every record with identical bytes.
+# When off, uploading a file that's already stored is refused instead.
+SDR_CONTENT_ADDRESSED_STORAGE = os.environ.get('SDR_CONTENT_ADDRESSED_STORAGE', '').lower() in ('1', 'true', 'yes')
+# Concurrent storage operations when renaming/moving files in batches
+STORAGE_MOVE_WORKERS = int(os.environ.get('STORAGE_MOVE_WORKERS', 8))
 COL_URL = 'http://webservice.catalogueoflife.org/col/webservice'
+# Total bytes of cached export files kept before least recently used ones are evicted
+EXPORT_CACHE_MAX_SIZE = int(os.environ.get('EXPORT_CACHE_MAX_SIZE', 500 * 1024 * 1024))
+# Tile pyramid and COG tasks run at once by process_sdr_files, however many worker threads it has
+SDR_PROCESSING_HEAVY_TASKS = int(os.environ.get('SDR_PROCESSING_HEAVY_TASKS', 1))
 
 # email
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
@@ -194,11 +219,26 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 STATIC_URL = '/static/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Same as the defaults, but uploads are hashed as they stream in (see app.storage.ContentHasher)
+FILE_UPLOAD_HANDLERS = [
+    'app.storage.HashingMemoryFileUploadHandler',
+    'app.storage.HashingTemporaryFileUploadHandler',
+]
 DEFAULT_FILE_STORAGE = 'app.utils.OverwriteFileSystemStorage'
 MEDIA_URL = '/media/'
+# Internal nginx location (config/webapp.nginxconf) that app.media.serve_media hands permitted downloads to with
+# X-Accel-Redirect; the Docker image sets it to /protected-media/. Empty (the default, e.g. runserver) serves media
+# from Django.
+MEDIA_ACCEL_REDIRECT = os.environ.get('MEDIA_ACCEL_REDIRECT', '')
+# Seconds the presigned S3 urls media downloads are redirected to stay valid
+MEDIA_PRESIGNED_URL_EXPIRY = int(os.environ.get('MEDIA_PRESIGNED_URL_EXPIRY', 300))
 if ENVIRONMENT in ('master',):
     DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
     MEDIA_URL = '//%s/%s/' % (AWS_S3_CUSTOM_DOMAIN, 'media')
+if AWS_S3_ENDPOINT_URL:
+    DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+    AWS_S3_CUSTOM_DOMAIN = None
+    MEDIA_URL = '%s/%s/' % (AWS_S3_ENDPOINT_URL.rstrip('/'), AWS_STORAGE_BUCKET_NAME)
 
 DEBUG_LEVEL = 'ERROR'
 if ENVIRONMENT in ('local', 'dev'):
@@ -215,7 +255,13 @@ LOGGING = {
             'level': DEBUG_LEVEL,
             'class': 'logging.StreamHandler',
             'stream': sys.stdout
-        }
+        },
+        'worker': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler',
+            'stream': sys.stdout,
+            'formatter': 'file',
+        },
     },
     'formatters': {
         'file': {
@@ -228,6 +274,11 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'sdr.processing': {
+            'handlers': ['worker'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         'django.security.DisallowedHost': {
             'handlers': ['null'],
             'propagate': False,
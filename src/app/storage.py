@@ -0,0 +1,382 @@
+import hashlib
+import mimetypes
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+import boto3
+import botocore
+
+MOVED = 'moved'
+MISSING = 'missing'
+FAILED = 'failed'
+
+# Content hashes are sha256 over the sha256 digests of consecutive blocks of this size, so they can be computed
+# incrementally from a stream or straight from the chunk digests of a resumable upload (whose chunks are this size)
+CONTENT_HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+class FileMoveError(Exception):
+    def __init__(self, results):
+        self.results = results
+        failed = [r for r in results if r.status == FAILED]
+        super(FileMoveError, self).__init__('%s of %s file move(s) failed: %s' % (
+            len(failed), len(results), '; '.join('%s -> %s: %s' % (r.old, r.new, r.error) for r in failed[:5])))
+
+
+class MoveResult(object):
+    def __init__(self, old, new, status, error=None):
+        self.old = old
+        self.new = new
+        self.status = status
+        self.error = error
+
+    def __repr__(self):
+        return '<MoveResult %s -> %s: %s>' % (self.old, self.new, self.status)
+
+
+def s3_client():
+    # boto3 clients (unlike resources) are thread-safe, so one is shared by every worker thread
+    global _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            _s3_client = boto3.session.Session().client(
+                's3', region_name=settings.AWS_REGION, endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+                aws_access_key_id=settings.AWS_ACCESS_KEY_ID, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
+        return _s3_client
+
+
+def is_s3_storage(storage):
+    return hasattr(storage, 'bucket_name') and hasattr(storage, '_normalize_name')
+
+
+def presigned_url(name, storage=None, expires=None):
+    # Always signed, unlike storage.url(), which returns a plain url when AWS_S3_CUSTOM_DOMAIN is set
+    storage = storage or default_storage
+    return s3_client().generate_presigned_url(
+        'get_object', Params={'Bucket': storage.bucket_name, 'Key': storage._normalize_name(storage._clean_name(name))},
+        ExpiresIn=expires or settings.MEDIA_PRESIGNED_URL_EXPIRY)
+
+
+def _move_s3(storage, old, new):
+    client = s3_client()
+    old_key = storage._normalize_name(storage._clean_name(old))
+    new_key = storage._normalize_name(storage._clean_name(new))
+    try:
+        client.head_object(Bucket=storage.bucket_name, Key=old_key)
+    except botocore.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return MISSING
+        raise
+    # Managed copy: server-side, and switches to multipart UploadPartCopy above 5GB
+    client.copy({'Bucket': storage.bucket_name, 'Key': old_key}, storage.bucket_name, new_key)
+    client.delete_object(Bucket=storage.bucket_name, Key=old_key)
+    return MOVED
+
+
+def _move_filesystem(storage, old, new):
+    old_path = storage.path(old)
+    if not os.path.isfile(old_path):
+        return MISSING
+    new_path = storage.path(new)
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    os.replace(old_path, new_path)
+    return MOVED
+
+
+def _move_streamed(storage, old, new):
+    if not storage.exists(old):
+        return MISSING
+    if storage.exists(new):
+        storage.delete(new)
+    with storage.open(old, 'rb') as f:
+        saved = storage.save(new, f)
+    if saved != new:
+        storage.delete(saved)
+        raise IOError('storage saved %s as %s' % (new, saved))
+    storage.delete(old)
+    return MOVED
+
+
+def get_mover(storage):
+    if is_s3_storage(storage):
+        return _move_s3
+    if isinstance(storage, FileSystemStorage):
+        return _move_filesystem
+    return _move_streamed
+
+
+def move_files(moves, storage=None, workers=None, progress=None):
+    """
+    Move each (old name, new name) pair within storage (default storage if None), on a bounded thread pool. Uses
+    server-side copy on S3, a rename on the filesystem, and a streamed copy for any other backend. Returns a
+    MoveResult per pair, in order; errors are captured in the result rather than raised, so callers can decide
+    whether to roll back. progress(done, total) is called from the calling thread as moves finish.
+    """
+    storage = storage or default_storage
+    workers = workers or settings.STORAGE_MOVE_WORKERS
+    mover = get_mover(storage)
+    moves = [(old, new) for old, new in moves if old != new]
+
+    def move(pair):
+        old, new = pair
+        try:
+            return MoveResult(old, new, mover(storage, old, new))
+        except Exception as e:
+            return MoveResult(old, new, FAILED, e)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(moves)))) as executor:
+        for result in executor.map(move, moves):
+            results.append(result)
+            if progress is not None:
+                progress(len(results), len(moves))
+    return results
+
+
+def _write_s3(storage, name, content):
+    kwargs = {'ContentType': mimetypes.guess_type(name)[0] or 'application/octet-stream'}
+    if getattr(storage, 'default_acl', None):
+        kwargs['ACL'] = storage.default_acl
+    s3_client().put_object(Bucket=storage.bucket_name, Key=storage._normalize_name(storage._clean_name(name)),
+                           Body=content, **kwargs)
+
+
+def _write_filesystem(storage, name, content):
+    path = storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def _write_streamed(storage, name, content):
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(content))
+
+
+def write_files(files, storage=None, workers=None):
+    """
+    Write each (name, bytes) pair from the files iterable to storage, overwriting, on a bounded thread pool. At most
+    a few pairs per worker are held in memory, so files can be a generator producing thousands of small objects
+    (e.g. image tiles). Returns the number written; raises the first error once submitted writes have finished.
+    """
+    storage = storage or default_storage
+    workers = workers or settings.STORAGE_MOVE_WORKERS
+    if is_s3_storage(storage):
+        writer = _write_s3
+    elif isinstance(storage, FileSystemStorage):
+        writer = _write_filesystem
+    else:
+        writer = _write_streamed
+
+    slots = threading.BoundedSemaphore(workers * 4)
+    errors = []
+    submitted = 0
+
+    def write(name, content):
+        try:
+            writer(storage, name, content)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for name, content in files:
+            if errors:
+                break
+            slots.acquire()
+            executor.submit(write, name, content)
+            submitted += 1
+    if errors:
+        raise errors[0]
+    return submitted
+
+
+def delete_prefix(prefix, storage=None):
+    # Delete a "directory" of files, e.g. a tile pyramid, with batched deletes on S3
+    storage = storage or default_storage
+    if is_s3_storage(storage):
+        client = s3_client()
+        key = storage._normalize_name(storage._clean_name(prefix)).rstrip('/') + '/'
+        for page in client.get_paginator('list_objects_v2').paginate(Bucket=storage.bucket_name, Prefix=key):
+            objects = [{'Key': o['Key']} for o in page.get('Contents', [])]
+            if objects:
+                client.delete_objects(Bucket=storage.bucket_name, Delete={'Objects': objects, 'Quiet': True})
+    elif isinstance(storage, FileSystemStorage):
+        shutil.rmtree(storage.path(prefix), ignore_errors=True)
+    elif storage.exists(prefix):
+        dirs, files = storage.listdir(prefix)
+        for d in dirs:
+            delete_prefix('%s/%s' % (prefix, d), storage)
+        for f in files:
+            storage.delete('%s/%s' % (prefix, f))
+
+
+def _s3_prefix(storage, name):
+    key = storage._normalize_name(storage._clean_name(name))
+    return key.rstrip('/') + '/' if key.strip('/') else ''
+
+
+def _list_s3(storage, prefix, delimiter=''):
+    # (file names, subdirectory names) under prefix, one list_objects_v2 page (1000 keys) at a time
+    client = s3_client()
+    root = _s3_prefix(storage, '')
+    files, dirs = [], []
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=storage.bucket_name, Prefix=_s3_prefix(storage, prefix),
+                                   Delimiter=delimiter):
+        files.extend(o['Key'][len(root):] for o in page.get('Contents', []))
+        dirs.extend(p['Prefix'][len(root):].rstrip('/') for p in page.get('CommonPrefixes', []))
+    return files, dirs
+
+
+def _list_filesystem(storage, prefix, recursive=True):
+    files, dirs = [], []
+    top = storage.path(prefix)
+    if not os.path.isdir(top):
+        return files, dirs
+    for path, subdirs, names in os.walk(top):
+        rel = os.path.relpath(path, storage.location).replace(os.sep, '/')
+        rel = '' if rel == '.' else rel + '/'
+        files.extend(rel + n for n in names)
+        if not recursive:
+            dirs.extend(rel + d for d in subdirs)
+            break
+    return files, dirs
+
+
+def _list_streamed(storage, prefix, recursive=True):
+    subdirs, names = storage.listdir(prefix)
+    rel = prefix + '/' if prefix else ''
+    files, dirs = [rel + n for n in names], [rel + d for d in subdirs]
+    if recursive:
+        for d in dirs:
+            files.extend(_list_streamed(storage, d)[0])
+        dirs = []
+    return files, dirs
+
+
+def list_files(storage=None, workers=None, progress=None):
+    """
+    Set of every file name in storage (default storage if None). The top level is listed first, then each
+    top-level directory (e.g. a tile pyramid) on a bounded thread pool, so listing a few hundred thousand objects
+    is bound by the number of directories rather than by sequential pages. progress(directories done, total) is
+    called from the calling thread.
+    """
+    storage = storage or default_storage
+    workers = workers or settings.STORAGE_MOVE_WORKERS
+    if is_s3_storage(storage):
+        top, lister = _list_s3(storage, '', '/'), lambda d: _list_s3(storage, d)[0]
+    elif isinstance(storage, FileSystemStorage):
+        top, lister = _list_filesystem(storage, '', False), lambda d: _list_filesystem(storage, d)[0]
+    else:
+        top, lister = _list_streamed(storage, '', False), lambda d: _list_streamed(storage, d)[0]
+
+    names, dirs = set(top[0]), top[1]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(dirs)))) as executor:
+        for i, listed in enumerate(executor.map(lister, dirs)):
+            names.update(listed)
+            if progress is not None:
+                progress(i + 1, len(dirs))
+    return names
+
+
+def delete_files(names, storage=None, workers=None):
+    # Batched deletes (1000 keys per request) on S3, otherwise one storage.delete per name on a thread pool
+    storage = storage or default_storage
+    workers = workers or settings.STORAGE_MOVE_WORKERS
+    names = list(names)
+    if is_s3_storage(storage):
+        batches = [names[i:i + 1000] for i in range(0, len(names), 1000)]
+
+        def delete(batch):
+            keys = [{'Key': storage._normalize_name(storage._clean_name(n))} for n in batch]
+            s3_client().delete_objects(Bucket=storage.bucket_name, Delete={'Objects': keys, 'Quiet': True})
+    else:
+        batches = names
+        delete = storage.delete
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as executor:
+        list(executor.map(delete, batches))
+    return len(names)
+
+
+class ContentHasher(object):
+    def __init__(self):
+        self.blocks = hashlib.sha256()
+        self.block = hashlib.sha256()
+        self.block_length = 0
+        self.block_count = 0
+
+    def update(self, data):
+        data = memoryview(data)
+        while len(data):
+            take = min(len(data), CONTENT_HASH_BLOCK_SIZE - self.block_length)
+            self.block.update(data[:take])
+            self.block_length += take
+            data = data[take:]
+            if self.block_length == CONTENT_HASH_BLOCK_SIZE:
+                self.blocks.update(self.block.digest())
+                self.block = hashlib.sha256()
+                self.block_length = 0
+                self.block_count += 1
+
+    def hexdigest(self):
+        blocks = self.blocks.copy()
+        if self.block_length or not self.block_count:
+            blocks.update(self.block.digest())
+        return blocks.hexdigest()
+
+
+def content_hash_from_blocks(block_digests):
+    # block_digests: hex sha256 of each CONTENT_HASH_BLOCK_SIZE block, in order
+    return hashlib.sha256(b''.join(bytes.fromhex(d) for d in block_digests)).hexdigest()
+
+
+def content_hash(f):
+    # f: any django File (uploaded or stored); reads it through once
+    hasher = ContentHasher()
+    f.open('rb')
+    try:
+        for chunk in f.chunks(CONTENT_HASH_BLOCK_SIZE):
+            hasher.update(chunk)
+    finally:
+        f.seek(0)
+    return hasher.hexdigest()
+
+
+class HashingUploadHandlerMixin(object):
+    """
+    Hashes uploaded files as they stream in, so the content hash is ready (as UploadedFile.content_hash) without
+    reading the upload again.
+    """
+    def new_file(self, *args, **kwargs):
+        # Before super(): MemoryFileUploadHandler.new_file raises StopFutureHandlers when it takes the file
+        self.hasher = ContentHasher()
+        super(HashingUploadHandlerMixin, self).new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super(HashingUploadHandlerMixin, self).receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        f = super(HashingUploadHandlerMixin, self).file_complete(file_size)
+        if f is not None:
+            f.content_hash = self.hasher.hexdigest()
+        return f
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
@@ -0,0 +1,24 @@
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, RequestFactory, override_settings
+from .storage import content_hash
+
+
+class HashingUploadHandlerTest(SimpleTestCase):
+    def upload(self, data):
+        # request.FILES parses the body with the FILE_UPLOAD_HANDLERS from settings
+        request = RequestFactory().post('/', {'file': SimpleUploadedFile('upload.bin', data)})
+        return request.FILES['file']
+
+    def test_small_upload_kept_in_memory_is_hashed(self):
+        data = b'small upload'
+        f = self.upload(data)
+        self.assertEqual(f.read(), data)
+        self.assertEqual(f.content_hash, content_hash(ContentFile(data)))
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=10)
+    def test_upload_written_to_disk_is_hashed(self):
+        data = b'x' * 100000
+        f = self.upload(data)
+        self.assertTrue(hasattr(f, 'temporary_file_path'))
+        self.assertEqual(f.content_hash, content_hash(ContentFile(data)))
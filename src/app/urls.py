@@ -19,7 +19,7 @@ from django.contrib.auth import views as auth_views
 from django.views.generic.base import RedirectView
 from django.core.urlresolvers import reverse_lazy
 from django.conf import settings
-from django.conf.urls.static import static
+from app.media import serve_media
 
 urlpatterns = [
     url(
@@ -44,11 +44,12 @@ urlpatterns = [
     ),
     url('^', include('django.contrib.auth.urls')),
     url(r'^admin/doc/', include('django.contrib.admindocs.urls')),
+    url(r'^uploads/', include('sdr.uploads')),
+    url(r'^media/(?P<path>.+)$', serve_media, name='media'),
     url(r'^admin/', include(admin.site.urls)),
     url(r'^$', RedirectView.as_view(url=reverse_lazy('admin:index'))),
 ]
 
 if settings.ENVIRONMENT not in ('prod',):
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     import debug_toolbar
     urlpatterns += [url(r'^__debug__/', include(debug_toolbar.urls))]
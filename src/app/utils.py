@@ -1,63 +1,344 @@
 import csv
 import datetime
 import copy
+import json
+import zipfile
+import zlib
 import requests
 from decimal import Decimal
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
 from django.core.urlresolvers import reverse
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ValidationError, FieldDoesNotExist
 from django.contrib import messages
 from django.contrib.gis import admin
 from django.contrib.gis.db import models
 # from django.contrib.gis.admin.widgets import OpenLayersWidget
 from django.contrib.admin import utils as admin_util
 from django.contrib.admin.actions import delete_selected
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
 from django.contrib.admin.options import FORMFIELD_FOR_DBFIELD_DEFAULTS
-from django.db.models import Max
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Max, prefetch_related_objects
 from django.forms.models import BaseInlineFormSet
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, QueryDict, StreamingHttpResponse
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from suit.widgets import AutosizedTextarea
 from muirweb.models import Element
 
+EXPORT_CHUNK_SIZE = 1000
 
-def export_model_as_csv(modeladmin, request, queryset):
+
+class Echo(object):
+    """
+    Pseudo-buffer implementing only the write() half of the file interface, so csv.writer hands each
+    formatted line straight back to us instead of accumulating it in memory.
+    """
+    def write(self, value):
+        return value
+
+
+def get_export_fields(modeladmin):
     if hasattr(modeladmin, 'exportable_fields'):
-        field_list = modeladmin.exportable_fields
-    else:
-        # Copy modeladmin.list_display to remove action_checkbox
-        field_list = list(modeladmin.list_display[:])
-        if 'action_checkbox' in field_list:
-            field_list.remove('action_checkbox')
-
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename=%s-%s-export_%s.csv' % (
+        return list(modeladmin.exportable_fields)
+
+    # Copy modeladmin.list_display to remove action_checkbox
+    field_list = list(modeladmin.list_display[:])
+    if 'action_checkbox' in field_list:
+        field_list.remove('action_checkbox')
+    return field_list
+
+
+def get_action_selection(request):
+    """
+    The changelist an admin action was run from, as (GET params, selected pks). Selected pks are None when the
+    action applies to every matching row ("select all").
+    """
+    params = {k: request.GET.getlist(k) for k in request.GET}
+    if request.POST.get('select_across') == '1':
+        return params, None
+    return params, request.POST.getlist(ACTION_CHECKBOX_NAME)
+
+
+def changelist_queryset(modeladmin, user, params, selected=None):
+    """
+    Rebuild the queryset an admin action was given from get_action_selection() output: the changelist's filters,
+    search and ordering applied by modeladmin as user, narrowed to the selected pks.
+    """
+    request = HttpRequest()
+    request.method = 'GET'
+    request.GET = QueryDict(mutable=True)
+    for k, values in params.items():
+        request.GET.setlist(k, values)
+    request.user = user or AnonymousUser()
+    list_display = modeladmin.get_list_display(request)
+    cl = modeladmin.get_changelist(request)(
+        request, modeladmin.model, list_display, modeladmin.get_list_display_links(request, list_display),
+        modeladmin.get_list_filter(request), modeladmin.date_hierarchy, modeladmin.get_search_fields(request),
+        modeladmin.get_list_select_related(request), modeladmin.list_per_page, modeladmin.list_max_show_all,
+        modeladmin.list_editable, modeladmin)
+    queryset = cl.get_queryset(request)
+    if selected is not None:
+        queryset = queryset.filter(pk__in=selected)
+    return queryset
+
+
+def get_export_filename(queryset, extension):
+    return '%s-%s-export_%s.%s' % (
         __package__.lower(),
         queryset.model.__name__.lower(),
         datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S'),
+        extension,
     )
 
-    writer = csv.writer(response)
-    writer.writerow(
-        [admin_util.label_for_field(f, queryset.model, modeladmin) for f in field_list],
-    )
 
-    for obj in queryset:
+def get_export_lookups(modeladmin, model, field_list):
+    """
+    Work out the select_related() and prefetch_related() lookups needed to resolve field_list without per-row queries.
+    Foreign keys are followed directly; callables (admin or model methods, including a related model's __str__)
+    declare what they touch with select_related/prefetch_related attributes, the same way they declare
+    admin_order_field.
+    """
+    select_related = set()
+    prefetch_related = set()
+
+    def add_hints(attr, prefix=''):
+        select_related.update(prefix + lookup for lookup in getattr(attr, 'select_related', ()))
+        prefetch_related.update(prefix + lookup for lookup in getattr(attr, 'prefetch_related', ()))
+
+    for name in field_list:
+        if callable(name):
+            add_hints(name)
+            continue
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            add_hints(getattr(modeladmin, name, None) or getattr(model, name, None))
+            continue
+        if field.many_to_many:
+            prefetch_related.add(name)
+        elif field.is_relation and field.concrete:
+            select_related.add(name)
+            add_hints(field.related_model.__str__, '%s__' % name)
+
+    return sorted(select_related), sorted(prefetch_related)
+
+
+def lookup_models(model, lookup):
+    """The models a select_related()/prefetch_related() lookup such as 'place__placename_set' passes through."""
+    found = []
+    for name in lookup.split('__'):
+        related = None
+        for field in model._meta.get_fields():
+            accessor = field.get_accessor_name() if field.auto_created and not field.concrete else None
+            if field.is_relation and name in (field.name, accessor):
+                related = field.related_model
+                break
+        if related is None:
+            break
+        found.append(related)
+        model = related
+    return found
+
+
+def plan_export_queryset(modeladmin, queryset, field_list):
+    """
+    Return the queryset with the joins it needs added, plus the prefetch lookups to apply to each chunk of rows.
+    """
+    select_related, prefetch_related = get_export_lookups(modeladmin, queryset.model, field_list)
+    # select_related() with no arguments (list_select_related = True) already follows every non-null FK, and
+    # adding named lookups to it would replace rather than extend it
+    if select_related and queryset.query.select_related is not True:
+        queryset = queryset.select_related(*select_related)
+    # noinspection PyProtectedMember
+    lookups = list(queryset._prefetch_related_lookups) + [
+        lookup for lookup in prefetch_related if lookup not in queryset._prefetch_related_lookups]
+    return queryset, lookups
+
+
+def iterate_prefetched(queryset, lookups, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    queryset.iterator() ignores prefetch_related(), so collect rows from the server-side cursor in chunks and run
+    each prefetch once per chunk: one query per lookup per chunk_size rows instead of one per row.
+    """
+    if not lookups:
+        for obj in queryset.iterator():
+            yield obj
+        return
+
+    chunk = []
+    for obj in queryset.iterator():
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            prefetch_related_objects(chunk, *lookups)
+            for prefetched in chunk:
+                yield prefetched
+            chunk = []
+    if chunk:
+        prefetch_related_objects(chunk, *lookups)
+        for prefetched in chunk:
+            yield prefetched
+
+
+def export_rows(modeladmin, queryset, field_list):
+    """
+    Yield the header row and then one row of values per object. Rows are read through a server-side cursor and
+    related objects are loaded per chunk (see plan_export_queryset), so memory stays flat and the number of queries
+    does not grow with each row.
+    """
+    queryset, lookups = plan_export_queryset(modeladmin, queryset, field_list)
+    yield [admin_util.label_for_field(f, queryset.model, modeladmin) for f in field_list]
+
+    for obj in iterate_prefetched(queryset, lookups):
         csv_line_values = []
         for field in field_list:
             field_obj, attr, value = admin_util.lookup_field(field, obj, modeladmin)
             csv_line_values.append(value)
+        yield csv_line_values
+
+
+def gzip_chunks(chunks):
+    """
+    Compress an iterable of bytes as a gzip stream, yielding output as the compressor produces it.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class ZipStream(object):
+    """
+    Write-only, unseekable buffer for zipfile. Without seek() zipfile writes data descriptors after each member
+    instead of going back to patch local headers, so the archive can be sent as it is built.
+    """
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_chunks(members):
+    """
+    Build a zip archive from (name, iterable of bytes) members, yielding compressed output as it is produced.
+    """
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, chunks in members:
+            with archive.open(name, 'w', force_zip64=True) as member:
+                for chunk in chunks:
+                    member.write(chunk)
+                    data = stream.drain()
+                    if data:
+                        yield data
+            yield stream.drain()
+    yield stream.drain()
+
+
+def get_export_schema(modeladmin, queryset, field_list):
+    opts = queryset.model._meta
+    columns = []
+    for name in field_list:
+        column = {
+            'name': getattr(name, '__name__', name),
+            'label': admin_util.label_for_field(name, queryset.model, modeladmin),
+            'type': 'computed',
+        }
+        try:
+            field = opts.get_field(name)
+            column['type'] = field.get_internal_type()
+            if field.help_text:
+                column['description'] = str(field.help_text)
+        except (FieldDoesNotExist, TypeError):
+            pass
+        columns.append(column)
+
+    return {
+        'model': opts.label_lower,
+        'verbose_name_plural': str(opts.verbose_name_plural),
+        'exported': datetime.datetime.now().isoformat(),
+        'rows': queryset.count(),
+        'encoding': 'utf-8',
+        'columns': columns,
+    }
 
-        writer.writerow(csv_line_values)
 
+def export_response(chunks, queryset, extension, content_type):
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename=%s' % get_export_filename(queryset, extension)
     return response
 
 
+def export_model_as_csv(modeladmin, request, queryset):
+    from exports.models import csv_chunks  # exports.models imports this module
+
+    chunks = csv_chunks(modeladmin, queryset, get_export_fields(modeladmin))
+    return export_response(chunks, queryset, 'csv', 'text/csv; charset=utf-8')
+
+
 export_model_as_csv.short_description = 'Export selected %(verbose_name_plural)s to CSV'
 
 
+def export_model_as_csv_gzip(modeladmin, request, queryset):
+    from exports.models import csv_chunks  # exports.models imports this module
+
+    chunks = csv_chunks(modeladmin, queryset, get_export_fields(modeladmin))
+    return export_response(gzip_chunks(chunks), queryset, 'csv.gz', 'application/gzip')
+
+
+export_model_as_csv_gzip.short_description = 'Export selected %(verbose_name_plural)s to gzipped CSV'
+
+
+def export_model_as_zip(modeladmin, request, queryset):
+    from exports.models import csv_chunks  # exports.models imports this module
+
+    field_list = get_export_fields(modeladmin)
+    name = get_export_filename(queryset, 'csv')
+
+    def schema():
+        yield json.dumps(get_export_schema(modeladmin, queryset, field_list), indent=2).encode('utf-8')
+
+    members = (
+        (name, csv_chunks(modeladmin, queryset, field_list)),
+        ('%s.schema.json' % name[:-4], schema()),
+    )
+    return export_response(zip_chunks(members), queryset, 'zip', 'application/zip')
+
+
+export_model_as_zip.short_description = 'Export selected %(verbose_name_plural)s to zipped CSV with schema'
+
+
+def export_model_as_csv_background(modeladmin, request, queryset):
+    from exports.models import ExportJob  # exports.models imports this module
+
+    job = ExportJob.enqueue(modeladmin, request, queryset, get_export_fields(modeladmin))
+    link = reverse('admin:%s_%s_change' % (job._meta.app_label, job._meta.model_name), args=(job.pk,))
+    modeladmin.message_user(request, format_html(
+        'Export queued as <a href="{0}">{1}</a>. A download link will appear there when it is ready.', link, job))
+
+
+export_model_as_csv_background.short_description = 'Export selected %(verbose_name_plural)s to CSV in the background'
+
+
 # obj is an SDR object
 def zotero_link(obj):
     return format_html('<a href="https://www.zotero.org/groups/{0}/items/itemKey/{1}" target="_blank">{2}</a>',
@@ -108,9 +389,24 @@ class NoFooterMixin(object):
         }
 
 
+class PrefetchingChangeList(ChangeList):
+    """
+    Prefetches what the list_display columns declare in their prefetch_related hints (see get_export_lookups), so a
+    page of rows costs one query per lookup rather than one per row and column.
+    """
+    def get_queryset(self, request):
+        qs = super(PrefetchingChangeList, self).get_queryset(request)
+        select_related, prefetch_related = get_export_lookups(self.model_admin, self.model, self.list_display)
+        lookups = [lookup for lookup in prefetch_related if lookup not in qs._prefetch_related_lookups]
+        return qs.prefetch_related(*lookups) if lookups else qs
+
+
 class SdrBaseAdmin(admin.OSMGeoAdmin, NoFooterMixin):
     list_select_related = True
 
+    def get_changelist(self, request, **kwargs):
+        return PrefetchingChangeList
+
     default_lat = settings.DEFAULT_LAT
     default_lon = settings.DEFAULT_LON
     default_zoom = settings.DEFAULT_ZOOM
@@ -135,7 +431,7 @@ class SdrBaseAdmin(admin.OSMGeoAdmin, NoFooterMixin):
     #
     #     return inline_instances
 
-    actions = (export_model_as_csv,)
+    actions = (export_model_as_csv, export_model_as_csv_gzip, export_model_as_zip, export_model_as_csv_background)
 
 
 class ReferenceAdmin(SdrBaseAdmin):
@@ -177,13 +473,15 @@ class CanonicalSdrBaseAdmin(SdrBaseAdmin):
         link = reverse('admin:%s_%s_change' % (p.app_label, p.model_name), args=(obj.place.pk,))
         formatted = format_html('<a href="{0}">{1}</a>', link, obj.place)
         return mark_safe(formatted)
-    place_link.admin_order_field = 'place'
+    place_link.admin_order_field = 'place__canonical_name'
     place_link.short_description = 'place'
+    place_link.select_related = ('place',)
 
     def place__featuretype(self, obj):
         return obj.place.featuretype
     place__featuretype.admin_order_field = 'featuretype'
     place__featuretype.short_description = 'feature type'
+    place__featuretype.select_related = ('place__featuretype',)
 
     def sdr_display(self, obj):
         s = obj.sdr.__class__._meta
@@ -192,6 +490,7 @@ class CanonicalSdrBaseAdmin(SdrBaseAdmin):
         return mark_safe('%s [%s]' % (sdr_formatted, zotero_link(obj.sdr)))
     sdr_display.admin_order_field = 'sdr'
     sdr_display.short_description = 'SDR'
+    sdr_display.select_related = ('sdr',)
 
     def delete_view(self, request, object_id, extra_context=None):
         obj = self.get_object(request, admin_util.unquote(object_id))
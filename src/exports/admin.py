@@ -0,0 +1,50 @@
+from app.utils import *
+from app.media import media_url
+from .models import ExportJob, ExportCache
+
+
+def requeue_export_jobs(modeladmin, request, queryset):
+    updated = queryset.exclude(status=ExportJob.QUEUED).update(
+        status=ExportJob.QUEUED, error='', started=None, finished=None)
+    modeladmin.message_user(request, '%s export job(s) requeued.' % updated)
+
+
+requeue_export_jobs.short_description = 'Requeue selected export jobs'
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(SdrBaseAdmin):
+    list_display = ('id', 'content_type', 'status', 'row_count', 'created_by', 'created', 'finished', 'download_link')
+    list_display_links = ('id', 'content_type')
+    list_filter = ('status', 'content_type')
+    actions = (requeue_export_jobs,)
+    fields = ('content_type', 'fields', 'status', 'row_count', 'download_link', 'created_by', 'created', 'started',
+              'finished', 'error')
+    readonly_fields = fields
+
+    def download_link(self, obj):
+        if obj.status == ExportJob.DONE and obj.file:
+            return format_html('<a href="{0}">download</a>', media_url(obj.file.name))
+        return ''
+    download_link.short_description = 'file'
+
+    def get_queryset(self, request):
+        qs = super(ExportJobAdmin, self).get_queryset(request)
+        if not request.user.is_superuser:
+            qs = qs.filter(created_by=request.user)
+        return qs
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ExportCache)
+class ExportCacheAdmin(SdrBaseAdmin):
+    list_display = ('key', 'content_type', 'size', 'hits', 'created', 'last_used')
+    list_filter = ('content_type',)
+    actions = None
+    fields = ('key', 'content_type', 'file', 'size', 'hits', 'created', 'last_used')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
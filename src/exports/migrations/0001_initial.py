@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fields', django.contrib.postgres.fields.jsonb.JSONField(verbose_name='exported fields')),
+                ('query', models.BinaryField()),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'),
+                                                     ('failed', 'failed')],
+                                            db_index=True, default='queued', max_length=10)),
+                ('file', models.FileField(blank=True, null=True, upload_to='exports/%Y/%m/')),
+                ('row_count', models.IntegerField(blank=True, null=True, verbose_name='rows')),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                   to='contenttypes.ContentType', verbose_name='model')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                                                 to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'export job',
+                'verbose_name_plural': 'export jobs',
+                'ordering': ['-created'],
+            },
+        ),
+    ]
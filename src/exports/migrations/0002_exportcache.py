@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('exports', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportCache',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(upload_to='exports/cache/')),
+                ('size', models.BigIntegerField(default=0)),
+                ('hits', models.IntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('last_used', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                   to='contenttypes.ContentType', verbose_name='model')),
+            ],
+            options={
+                'verbose_name': 'cached export',
+                'verbose_name_plural': 'cached exports',
+                'ordering': ['-last_used'],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exports', '0002_exportcache'),
+    ]
+
+    operations = [
+        # Unfinished jobs only have a pickled query, which is no longer read
+        migrations.RunSQL(
+            "UPDATE exports_exportjob SET status = 'failed', error = 'Queued before an upgrade; please export again.' "
+            "WHERE status IN ('queued', 'running')",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RemoveField(
+            model_name='exportjob',
+            name='query',
+        ),
+        migrations.AddField(
+            model_name='exportjob',
+            name='params',
+            field=django.contrib.postgres.fields.jsonb.JSONField(default=dict, verbose_name='changelist parameters'),
+        ),
+        migrations.AddField(
+            model_name='exportjob',
+            name='selected',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True, verbose_name='selected ids'),
+        ),
+    ]
@@ -0,0 +1,277 @@
+import csv
+import hashlib
+import io
+import json
+import tempfile
+import time
+from django.apps import apps
+from django.conf import settings
+from django.contrib.gis.db import models
+from django.contrib.admin import site
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.fields import JSONField
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.files import File
+from django.db import IntegrityError
+from django.db.models import Count, Max, Sum
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+from app.utils import Echo, changelist_queryset, export_rows, get_action_selection, get_export_filename
+from app.utils import get_export_fields, get_export_lookups, lookup_models
+
+# Models whose exports are cached, mapped to models their exports depend on that the exported fields' lookups don't
+# show (child counts, place names). A cached export is keyed on its model's last_modified/count watermark and
+# dropped whenever the model or one of its dependencies (these, plus the related models the exported fields read;
+# see export_dependencies) is saved or deleted.
+CACHE_DEPENDENCIES = {
+    'sdr.sdr': ('sdr.scan', 'sdr.georef', 'sdr.feature'),
+    'pn.place': ('pn.placename',),
+    'species.species': (),
+}
+CACHE_READ_SIZE = 64 * 1024
+INVALIDATED_CACHE_KEY = 'export-cache-invalidated:%s'
+
+
+class ExportJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    )
+
+    content_type = models.ForeignKey(ContentType, verbose_name='model', on_delete=models.CASCADE)
+    fields = JSONField(verbose_name='exported fields')
+    # The changelist the export was started from (filters, search, ordering) and the selected pks, or null when
+    # every matching row was selected; the worker rebuilds the queryset from these through the model's admin
+    params = JSONField(default=dict, verbose_name='changelist parameters')
+    selected = JSONField(null=True, blank=True, verbose_name='selected ids')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    file = models.FileField(upload_to='exports/%Y/%m/', null=True, blank=True)
+    row_count = models.IntegerField(null=True, blank=True, verbose_name='rows')
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'export job'
+        verbose_name_plural = 'export jobs'
+        ordering = ['-created']
+
+    def __str__(self):
+        return '%s export %s' % (self.content_type.model_class()._meta.verbose_name, self.pk)
+
+    @classmethod
+    def enqueue(cls, modeladmin, request, queryset, field_list):
+        params, selected = get_action_selection(request)
+        return cls.objects.create(
+            content_type=ContentType.objects.get_for_model(queryset.model),
+            fields=field_list,
+            params=params,
+            selected=selected,
+            created_by=request.user,
+        )
+
+    @classmethod
+    def claim_next(cls):
+        # Must be called inside a transaction; skip_locked lets any number of workers poll the same table
+        return cls.objects.select_for_update(skip_locked=True).filter(status=cls.QUEUED).order_by('created').first()
+
+    def get_queryset(self):
+        modeladmin = site._registry[self.content_type.model_class()]
+        return changelist_queryset(modeladmin, self.created_by, self.params, self.selected)
+
+    def run(self):
+        queryset = self.get_queryset()
+        modeladmin = site._registry[queryset.model]
+        rows = 0
+
+        # Spool to a local temp file so the worker's memory stays flat, then hand it to DEFAULT_FILE_STORAGE
+        with tempfile.TemporaryFile() as tmp:
+            out = io.TextIOWrapper(tmp, encoding='utf-8', newline='')
+            writer = csv.writer(out)
+            for row in export_rows(modeladmin, queryset, self.fields):
+                writer.writerow(row)
+                rows += 1
+            out.flush()
+            tmp.seek(0)
+            filename = get_export_filename(queryset, 'csv')
+            self.file.save(filename, File(tmp, name=filename), save=False)
+            out.detach()
+
+        self.row_count = rows - 1  # header
+        self.status = self.DONE
+        self.finished = timezone.now()
+        self.save()
+
+
+class ExportCache(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    content_type = models.ForeignKey(ContentType, verbose_name='model', on_delete=models.CASCADE)
+    file = models.FileField(upload_to='exports/cache/')
+    size = models.BigIntegerField(default=0)
+    hits = models.IntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = 'cached export'
+        verbose_name_plural = 'cached exports'
+        ordering = ['-last_used']
+
+    def __str__(self):
+        return '%s export %s' % (self.content_type.model_class()._meta.verbose_name, self.key[:8])
+
+    @classmethod
+    def make_key(cls, queryset, field_list):
+        """
+        Hash the model, exported fields, the queryset's SQL (filters, ordering, row selection) and a watermark of
+        the table's latest last_modified and row count. Returns None for exports that can't be cached.
+        """
+        model = queryset.model
+        label = model._meta.label_lower
+        if label not in CACHE_DEPENDENCIES:
+            return None
+        try:
+            # str(query) interpolates the parameters only approximately, so different filters could share a key
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return None
+
+        # _base_manager skips manager annotations (e.g. SdrManager's counts) that would slow this query down
+        watermark = model._base_manager.aggregate(last_modified=Max('last_modified'), count=Count('pk'))
+        raw = json.dumps([
+            label,
+            [getattr(f, '__name__', f) for f in field_list],
+            sql,
+            params,
+            str(watermark['last_modified']),
+            watermark['count'],
+        ], default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def store(cls, key, model, tmp):
+        size = tmp.tell()
+        tmp.seek(0)
+        entry = cls(key=key, content_type=ContentType.objects.get_for_model(model), size=size)
+        entry.file.save('%s.csv' % key, File(tmp, name='%s.csv' % key), save=False)
+        try:
+            entry.save()
+        except IntegrityError:
+            # Another request cached the same export first
+            entry.file.delete(save=False)
+            return
+        cls.evict()
+
+    @classmethod
+    def evict(cls):
+        """
+        Delete least recently used entries until the cache fits in settings.EXPORT_CACHE_MAX_SIZE bytes.
+        """
+        total = cls.objects.aggregate(total=Sum('size'))['total'] or 0
+        for entry in cls.objects.order_by('last_used'):
+            if total <= settings.EXPORT_CACHE_MAX_SIZE:
+                break
+            total -= entry.size
+            entry.delete()
+
+    @classmethod
+    def invalidate(cls, label):
+        app_label, model_name = label.split('.')
+        # Exports still streaming when this runs were read from data that is now out of date (see csv_chunks)
+        cache.set(INVALIDATED_CACHE_KEY % label, time.time(), None)
+        # Deleting instances (rather than a bare DELETE) lets django_cleanup remove the cached files
+        for entry in cls.objects.filter(content_type__app_label=app_label, content_type__model=model_name):
+            entry.delete()
+
+    def read(self):
+        self.hits += 1
+        self.last_used = timezone.now()
+        self.save(update_fields=['hits', 'last_used'])
+
+        with self.file.storage.open(self.file.name, 'rb') as f:
+            while True:
+                chunk = f.read(CACHE_READ_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+
+def csv_chunks(modeladmin, queryset, field_list):
+    """
+    Yield an export as UTF-8 CSV bytes, served from the export cache when the data hasn't changed since it was
+    cached. Otherwise the export is streamed as it is generated and copied to a temp file, which is added to the
+    cache once the whole export has been sent.
+    """
+    started = time.time()
+    key = ExportCache.make_key(queryset, field_list)
+    if key is not None:
+        entry = ExportCache.objects.filter(key=key).first()
+        if entry is not None:
+            if entry.file.storage.exists(entry.file.name):
+                for chunk in entry.read():
+                    yield chunk
+                return
+            entry.delete()
+
+    writer = csv.writer(Echo())
+    tmp = tempfile.TemporaryFile() if key is not None else None
+    try:
+        for row in export_rows(modeladmin, queryset, field_list):
+            chunk = writer.writerow(row).encode('utf-8')
+            if tmp is not None:
+                tmp.write(chunk)
+            yield chunk
+        # The key's watermark was taken before the rows were read; a change saved meanwhile means the rows may
+        # mix old and new data, so only cache them if it still holds and nothing invalidated the model since
+        # (update() paths invalidate without moving the watermark)
+        if tmp is not None:
+            invalidated = cache.get(INVALIDATED_CACHE_KEY % queryset.model._meta.label_lower) or 0
+            if invalidated < started and ExportCache.make_key(queryset, field_list) == key:
+                ExportCache.store(key, queryset.model, tmp)
+    finally:
+        if tmp is not None:
+            tmp.close()
+
+
+_export_dependencies = {}
+
+
+def export_dependencies(label):
+    """
+    Labels of the models whose changes alter the cached exports of label: its CACHE_DEPENDENCIES, plus every model
+    the exported fields are read through (the lookups from app.utils.get_export_lookups, e.g. a type shown by name).
+    """
+    if label not in _export_dependencies:
+        model = apps.get_model(label)
+        modeladmin = site._registry.get(model)
+        dependencies = set(CACHE_DEPENDENCIES[label])
+        if modeladmin is None:
+            return dependencies  # admin not loaded yet (e.g. during migrations); work it out next time
+        select_related, prefetch_related = get_export_lookups(modeladmin, model, get_export_fields(modeladmin))
+        for lookup in select_related + prefetch_related:
+            dependencies.update(related._meta.label_lower for related in lookup_models(model, lookup))
+        dependencies.discard(label)
+        _export_dependencies[label] = dependencies
+    return _export_dependencies[label]
+
+
+def invalidate_export_cache(sender, **kwargs):
+    label = sender._meta.label_lower
+    for cached in CACHE_DEPENDENCIES:
+        if label == cached or label in export_dependencies(cached):
+            ExportCache.invalidate(cached)
+
+
+# Every model, since the dependencies depend on the registered admins, which aren't loaded yet
+post_save.connect(invalidate_export_cache, dispatch_uid='export_cache_save')
+post_delete.connect(invalidate_export_cache, dispatch_uid='export_cache_delete')
@@ -0,0 +1,42 @@
+import shutil
+import tempfile
+from django.test import TestCase, override_settings
+from species.models import Taxon, Species
+from species.tests import make_species
+from .models import ExportCache, export_dependencies
+
+
+class ExportCacheTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.taxon = Taxon.objects.create(name='Birds')
+        make_species(self.taxon, 'robin', 'Turdus migratorius')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def cache_export(self, queryset, field_list):
+        tmp = tempfile.TemporaryFile()
+        tmp.write(b'cached\r\n')
+        ExportCache.store(ExportCache.make_key(queryset, field_list), queryset.model, tmp)
+
+    def test_dependencies_include_models_shown_by_name(self):
+        self.assertIn('species.taxon', export_dependencies('species.species'))
+        self.assertIn('sdr.deftype', export_dependencies('sdr.sdr'))
+        self.assertIn('pn.placename', export_dependencies('pn.place'))
+
+    def test_key_depends_on_filter_values(self):
+        field_list = ['name_accepted']
+        self.assertNotEqual(
+            ExportCache.make_key(Species.objects.filter(name_accepted='Turdus migratorius'), field_list),
+            ExportCache.make_key(Species.objects.filter(name_accepted='Turdus merula'), field_list))
+
+    def test_renaming_a_related_row_invalidates_the_export(self):
+        self.cache_export(Species.objects.all(), ['name_accepted', 'taxon'])
+        self.assertEqual(ExportCache.objects.count(), 1)
+        self.taxon.name = 'Aves'
+        self.taxon.save()
+        self.assertEqual(ExportCache.objects.count(), 0)
@@ -1,6 +1,7 @@
 from django.core import urlresolvers
 from app.utils import *
 from .models import *
+from .exports import export_graphml, export_node_link_json, export_edge_list
 
 
 @admin.register(DefinitionType)
@@ -116,6 +117,7 @@ class ElementAdmin(SdrBaseAdmin):
     search_fields = ['elementid', 'name']
     list_per_page = 200
     list_max_show_all = 5000
+    actions = SdrBaseAdmin.actions + (export_graphml, export_node_link_json, export_edge_list)
 
     fields = (('elementid', 'name'),
               'species',
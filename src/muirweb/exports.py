@@ -0,0 +1,162 @@
+import json
+from xml.sax.saxutils import escape, quoteattr
+from django.http import StreamingHttpResponse
+from app.utils import get_export_filename
+from .models import Element, Relationship
+
+NODE_ATTRIBUTES = (
+    # (name, GraphML type)
+    ('name', 'string'),
+    ('definitiontype', 'string'),
+    ('frequencytype', 'string'),
+    ('frequency_maxprob', 'double'),
+    ('spatially_explicit', 'boolean'),
+)
+
+EDGE_ATTRIBUTES = (
+    ('state_id', 'int'),
+    ('state', 'string'),
+    ('group_id', 'int'),
+    ('group', 'string'),
+    ('strength', 'string'),
+    ('strength_prob', 'int'),
+    ('interaction', 'string'),
+    ('operation', 'string'),
+)
+
+EDGE_LIST_COLUMNS = ('source', 'target', 'state_id', 'state', 'group_id', 'group', 'strength_prob', 'operation')
+
+
+def _number(value):
+    return None if value is None else float(value)
+
+
+def muirweb_graph(elements=None):
+    """
+    Return (nodes, edges) for the Muir Web, or for the subgraph induced by an Element queryset, as lists of flat
+    dicts. Each is one query; edges are joined to their nodes in memory by element pk.
+    """
+    if elements is None:
+        elements = Element.objects.all()
+
+    nodes = {}
+    for pk, elementid, name, definitiontype, frequencytype, maxprob, spatially_explicit in elements.values_list(
+            'pk', 'elementid', 'name', 'definitiontype__name', 'frequencytype__name', 'frequencytype__maxprob',
+            'spatially_explicit').order_by('elementid').iterator():
+        nodes[pk] = {
+            'id': str(elementid),
+            'name': name,
+            'definitiontype': definitiontype,
+            'frequencytype': frequencytype,
+            'frequency_maxprob': _number(maxprob),
+            'spatially_explicit': spatially_explicit,
+        }
+
+    relationships = Relationship.objects.all()
+    if elements.query.where:
+        relationships = relationships.filter(subject__in=elements.values('pk'), object__in=elements.values('pk'))
+
+    edges = []
+    for (pk, subject_id, object_id, state_id, state, group_id, group, strength, strength_prob, interaction,
+         operation) in relationships.values_list(
+            'pk', 'subject_id', 'object_id', 'state_id', 'state__label__name', 'relationshiptype_id',
+            'relationshiptype__label__name', 'strengthtype__name', 'strengthtype__prob', 'interactiontype__name',
+            'interactiontype__operation').order_by('pk').iterator():
+        if subject_id not in nodes or object_id not in nodes:
+            continue
+        edges.append({
+            'id': pk,
+            'source': nodes[subject_id]['id'],
+            'target': nodes[object_id]['id'],
+            'state_id': state_id,
+            'state': state,
+            'group_id': group_id,
+            'group': group,
+            'strength': strength,
+            'strength_prob': strength_prob,
+            'interaction': interaction,
+            'operation': operation,
+        })
+
+    return list(nodes.values()), edges
+
+
+def _graphml_data(key, value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    return '<data key="%s">%s</data>' % (key, escape(str(value)))
+
+
+def graphml_chunks(nodes, edges):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n' \
+          '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+    for name, attr_type in NODE_ATTRIBUTES:
+        yield '<key id="%s" for="node" attr.name="%s" attr.type="%s"/>\n' % (name, name, attr_type)
+    for name, attr_type in EDGE_ATTRIBUTES:
+        yield '<key id="%s" for="edge" attr.name="%s" attr.type="%s"/>\n' % (name, name, attr_type)
+    yield '<graph id="muirweb" edgedefault="directed">\n'
+    for node in nodes:
+        yield '<node id=%s>%s</node>\n' % (
+            quoteattr(node['id']), ''.join(_graphml_data(name, node[name]) for name, attr_type in NODE_ATTRIBUTES))
+    for edge in edges:
+        yield '<edge id="r%s" source=%s target=%s>%s</edge>\n' % (
+            edge['id'], quoteattr(edge['source']), quoteattr(edge['target']),
+            ''.join(_graphml_data(name, edge[name]) for name, attr_type in EDGE_ATTRIBUTES))
+    yield '</graph>\n</graphml>\n'
+
+
+def node_link_chunks(nodes, edges):
+    # Same layout as networkx's node_link_data(), so json_graph.node_link_graph() can load it directly
+    yield '{"directed": true, "multigraph": true, "graph": {"name": "muirweb"},\n"nodes": [\n'
+    yield ',\n'.join(json.dumps(node) for node in nodes)
+    yield '\n],\n"links": [\n'
+    yield ',\n'.join(json.dumps(dict(edge, key=edge['id'])) for edge in edges)
+    yield '\n]}\n'
+
+
+def edge_list_chunks(nodes, edges):
+    # Group labels aren't unique (every "condition for" set of relationships is its own Group), so the ids are what
+    # identifies a state or an AND/OR group; the labels are there for reading
+    yield '\t'.join(EDGE_LIST_COLUMNS) + '\n'
+    for edge in edges:
+        yield '\t'.join('' if edge[name] is None else str(edge[name]) for name in EDGE_LIST_COLUMNS) + '\n'
+
+
+GRAPH_FORMATS = {
+    # format: (chunk generator, file extension, content type)
+    'graphml': (graphml_chunks, 'graphml', 'application/graphml+xml'),
+    'json': (node_link_chunks, 'json', 'application/json'),
+    'edgelist': (edge_list_chunks, 'tsv', 'text/tab-separated-values'),
+}
+
+
+def _graph_response(queryset, fmt):
+    chunks, extension, content_type = GRAPH_FORMATS[fmt]
+    nodes, edges = muirweb_graph(queryset)
+    response = StreamingHttpResponse(chunks(nodes, edges), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename=%s' % get_export_filename(queryset, extension)
+    return response
+
+
+def export_graphml(modeladmin, request, queryset):
+    return _graph_response(queryset, 'graphml')
+
+
+export_graphml.short_description = 'Export selected %(verbose_name_plural)s and their relationships to GraphML'
+
+
+def export_node_link_json(modeladmin, request, queryset):
+    return _graph_response(queryset, 'json')
+
+
+export_node_link_json.short_description = 'Export selected %(verbose_name_plural)s and their relationships to ' \
+                                          'node-link JSON'
+
+
+def export_edge_list(modeladmin, request, queryset):
+    return _graph_response(queryset, 'edgelist')
+
+
+export_edge_list.short_description = 'Export relationships among selected %(verbose_name_plural)s as an edge list'
@@ -0,0 +1,28 @@
+from decimal import Decimal
+from django.test import TestCase
+from .exports import muirweb_graph, edge_list_chunks
+from .models import (Element, Relationship, State, StateLabel, Group, GroupLabel, StrengthType, InteractionType)
+
+
+class EdgeListExportTest(TestCase):
+    def setUp(self):
+        self.subject = Element.objects.create(elementid=Decimal('1.00'), name='beaver')
+        objects = [Element.objects.create(elementid=Decimal('%s.00' % i), name='object %s' % i) for i in (2, 3)]
+        state = State.objects.create(label=StateLabel.objects.create(name='present'))
+        group = Group.objects.create(label=GroupLabel.objects.create(name='condition for'))
+        strength = StrengthType.objects.create(name='strong', prob=90)
+        interaction = InteractionType.objects.create(name='requires', operation='and')
+        # the second "condition for" relationship of the subject gets a new Group with the same label
+        for obj in objects:
+            Relationship.objects.create(subject=self.subject, object=obj, state=state, relationshiptype=group,
+                                        strengthtype=strength, interactiontype=interaction)
+
+    def test_groups_with_the_same_label_keep_their_ids(self):
+        lines = ''.join(edge_list_chunks(*muirweb_graph())).splitlines()
+        header = lines[0].split('\t')
+        rows = [dict(zip(header, line.split('\t'))) for line in lines[1:]]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(set(row['group'] for row in rows), {'condition for'})
+        self.assertEqual(set(row['group_id'] for row in rows),
+                         set(str(pk) for pk in Relationship.objects.values_list('relationshiptype_id', flat=True)))
+        self.assertEqual(len(set(row['group_id'] for row in rows)), 2)
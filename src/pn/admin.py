@@ -1,6 +1,7 @@
 from django.forms import ModelForm
 from app.utils import *
 from pn.models import *
+from pn.exports import export_geojson, export_ndjson, export_gpkg
 
 
 class CanonicalAdminForm(ModelForm):
@@ -40,14 +41,15 @@ class PlacePointAdmin(CanonicalSdrBaseAdmin):
 
     def point__name(self, obj):
         return obj.__str__()
-    point__name.admin_order_field = 'point__name'
+    point__name.admin_order_field = 'place__canonical_name'
     point__name.short_description = 'point'
 
     list_display = (
         'point__name', 'place_link', 'canonical', 'invented', 'place__featuretype', 'sdr_display', 'pagenumbers')
-    search_fields = ['place__name']
+    search_fields = ['place__canonical_name', 'place__placename__name']
     list_filter = ('canonical', 'invented', 'place__featuretype', 'place__areas')
     exportable_fields = ['point__name', 'place', 'canonical', 'invented', 'place__featuretype', 'sdr', 'pagenumbers']
+    actions = CanonicalSdrBaseAdmin.actions + (export_geojson, export_ndjson)
 
 
 class PlaceLineAdmin(CanonicalSdrBaseAdmin):
@@ -55,14 +57,15 @@ class PlaceLineAdmin(CanonicalSdrBaseAdmin):
 
     def line__name(self, obj):
         return obj.__str__()
-    line__name.admin_order_field = 'line__name'
+    line__name.admin_order_field = 'place__canonical_name'
     line__name.short_description = 'line'
 
     list_display = (
         'line__name', 'place_link', 'canonical', 'invented', 'place__featuretype', 'sdr_display', 'pagenumbers')
-    search_fields = ['place__name']
+    search_fields = ['place__canonical_name', 'place__placename__name']
     list_filter = ('canonical', 'invented', 'place__featuretype', 'place__areas')
     exportable_fields = ['line__name', 'place', 'canonical', 'invented', 'place__featuretype', 'sdr', 'pagenumbers']
+    actions = CanonicalSdrBaseAdmin.actions + (export_geojson, export_ndjson)
 
 
 class PlacePolygonAdmin(CanonicalSdrBaseAdmin):
@@ -70,14 +73,15 @@ class PlacePolygonAdmin(CanonicalSdrBaseAdmin):
 
     def polygon__name(self, obj):
         return obj.__str__()
-    polygon__name.admin_order_field = 'polygon__name'
+    polygon__name.admin_order_field = 'place__canonical_name'
     polygon__name.short_description = 'polygon'
 
     list_display = (
         'polygon__name', 'place_link', 'canonical', 'invented', 'place__featuretype', 'sdr_display', 'pagenumbers')
-    search_fields = ['place__name']
+    search_fields = ['place__canonical_name', 'place__placename__name']
     list_filter = ('canonical', 'invented', 'place__featuretype', 'place__areas')
     exportable_fields = ['polygon__name', 'place', 'canonical', 'invented', 'place__featuretype', 'sdr', 'pagenumbers']
+    actions = CanonicalSdrBaseAdmin.actions + (export_geojson, export_ndjson)
 
 
 class PlacenameInlineFormset(CanonicalInlineFormset):
@@ -184,7 +188,7 @@ class RelatedFromPlacesInline(RelatedPlacesInline):
 class PlaceAdmin(SdrBaseAdmin):
     def place__name(self, obj):
         return obj.__str__()
-    place__name.admin_order_field = 'place__name'
+    place__name.admin_order_field = 'canonical_name'
     place__name.short_description = 'place'
 
     def last_modified_formatted(self, obj):
@@ -198,6 +202,7 @@ class PlaceAdmin(SdrBaseAdmin):
     list_filter = ('featuretype',)
     exportable_fields = ['place__name', 'id', 'placenames_export', 'area_list_export', 'featuretype',
                          'last_modified_formatted']
+    actions = SdrBaseAdmin.actions + (export_gpkg,)
 
     readonly_fields = ('id',)
     fields = ('id', 'featuretype', 'areas')
@@ -0,0 +1,255 @@
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+from itertools import islice
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.contrib.postgres.aggregates import StringAgg
+from django.db.models import BinaryField, CharField, F, Func, Value
+from django.http import FileResponse, StreamingHttpResponse
+from app.utils import get_export_filename
+from pn.models import Place, Placename, PlacePoint, PlaceLine, PlacePolygon, Location, Description
+
+# Coordinate precision written to GeoJSON; 7 decimal places of a degree is about a centimetre
+GEOJSON_PRECISION = 7
+
+# Rows per executemany() when writing a GeoPackage
+GPKG_BATCH_SIZE = 5000
+GPKG_SRS_ID = 4326
+GPKG_WGS84_DEFINITION = (
+    'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],'
+    'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+    'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]'
+)
+# GeoPackage binary header: magic, version 0, flags (little-endian header, no envelope), srs_id
+GPKG_GEOMETRY_HEADER = b'GP' + struct.pack('<BBi', 0, 1, GPKG_SRS_ID)
+
+
+def geojson_features(queryset):
+    """
+    Yield one GeoJSON Feature string per PlacePoint/PlaceLine/PlacePolygon in queryset. Geometries are serialized by
+    PostGIS (ST_AsGeoJSON) and rows are read as flat tuples through a server-side cursor, so no model instances are
+    built and memory use does not depend on the size of the export.
+    """
+    rows = queryset.annotate(
+        geojson=AsGeoJSON('geom', precision=GEOJSON_PRECISION),
+        place_name=canonical_name('place__canonical_name'),
+    ).values_list(
+        'pk', 'geojson', 'place_id', 'place_name', 'place__featuretype__name', 'sdr_id', 'sdr__name_short',
+        'canonical', 'invented', 'pagenumbers',
+    ).order_by('pk')
+
+    for pk, geojson, place_id, place_name, featuretype, sdr_id, sdr_name, canonical, invented, pagenumbers in \
+            rows.iterator():
+        properties = json.dumps({
+            'place_id': place_id,
+            'place': place_name,
+            'featuretype': featuretype,
+            'sdr_id': sdr_id,
+            'sdr': sdr_name,
+            'canonical': canonical,
+            'invented': invented,
+            'pagenumbers': pagenumbers,
+        })
+        yield '{"type": "Feature", "id": %d, "geometry": %s, "properties": %s}' % (pk, geojson or 'null', properties)
+
+
+def geojson_feature_collection(queryset):
+    yield '{"type": "FeatureCollection", "features": [\n'
+    separator = ''
+    for feature in geojson_features(queryset):
+        yield separator + feature
+        separator = ',\n'
+    yield '\n]}\n'
+
+
+def ndjson_features(queryset):
+    for feature in geojson_features(queryset):
+        yield feature + '\n'
+
+
+def export_geojson(modeladmin, request, queryset):
+    response = StreamingHttpResponse(geojson_feature_collection(queryset), content_type='application/geo+json')
+    response['Content-Disposition'] = 'attachment; filename=%s' % get_export_filename(queryset, 'geojson')
+    return response
+
+
+export_geojson.short_description = 'Export selected %(verbose_name_plural)s to GeoJSON'
+
+
+def export_ndjson(modeladmin, request, queryset):
+    response = StreamingHttpResponse(ndjson_features(queryset), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename=%s' % get_export_filename(queryset, 'ndjson')
+    return response
+
+
+export_ndjson.short_description = 'Export selected %(verbose_name_plural)s to newline-delimited GeoJSON'
+
+
+def canonical_name(field):
+    # Places without a canonical placename are exported with a null name, not the empty string that's stored
+    return Func(F(field), Value(''), function='NULLIF', output_field=CharField())
+
+
+def _gpkg_geometry(wkb):
+    if wkb is None:
+        return None
+    return GPKG_GEOMETRY_HEADER + bytes(wkb)
+
+
+def _gpkg_init(db):
+    db.executescript("""
+        PRAGMA application_id = 1196444487;
+        PRAGMA user_version = 10200;
+        CREATE TABLE gpkg_spatial_ref_sys (
+            srs_name TEXT NOT NULL, srs_id INTEGER NOT NULL PRIMARY KEY, organization TEXT NOT NULL,
+            organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+        CREATE TABLE gpkg_contents (
+            table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+            description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+            min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+            srs_id INTEGER REFERENCES gpkg_spatial_ref_sys(srs_id));
+        CREATE TABLE gpkg_geometry_columns (
+            table_name TEXT NOT NULL UNIQUE REFERENCES gpkg_contents(table_name), column_name TEXT NOT NULL,
+            geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL REFERENCES gpkg_spatial_ref_sys(srs_id),
+            z TINYINT NOT NULL, m TINYINT NOT NULL, PRIMARY KEY (table_name, column_name));
+    """)
+    db.executemany('INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', [
+        ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', None),
+        ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', None),
+        ('WGS 84 geodetic', GPKG_SRS_ID, 'EPSG', GPKG_SRS_ID, GPKG_WGS84_DEFINITION, None),
+    ])
+
+
+def _gpkg_write_table(db, table, columns, rows, geometry_type=None, transform=None):
+    """
+    Create table with columns [(name, sqlite type)] and bulk-insert rows (an iterator of tuples) in batches.
+    """
+    db.execute('CREATE TABLE %s (%s)' % (table, ', '.join('%s %s' % c for c in columns)))
+    if geometry_type is None:
+        db.execute('INSERT INTO gpkg_contents (table_name, data_type, identifier) VALUES (?, ?, ?)',
+                   (table, 'attributes', table))
+    else:
+        db.execute('INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, ?, ?, ?)',
+                   (table, 'features', table, GPKG_SRS_ID))
+        db.execute('INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, 0, 0)',
+                   (table, 'geom', geometry_type, GPKG_SRS_ID))
+
+    insert = 'INSERT INTO %s VALUES (%s)' % (table, ', '.join('?' * len(columns)))
+    if transform is not None:
+        rows = (transform(row) for row in rows)
+    count = 0
+    while True:
+        batch = list(islice(rows, GPKG_BATCH_SIZE))
+        if not batch:
+            return count
+        db.executemany(insert, batch)
+        count += len(batch)
+
+
+GPKG_GEOMETRY_LAYERS = (
+    ('place_points', PlacePoint, 'MULTIPOINT'),
+    ('place_lines', PlaceLine, 'MULTILINESTRING'),
+    ('place_polygons', PlacePolygon, 'MULTIPOLYGON'),
+)
+
+GPKG_SOURCE_COLUMNS = [
+    ('sdr_id', 'INTEGER'),
+    ('sdr', 'TEXT'),
+    ('pagenumbers', 'TEXT'),
+]
+
+
+def write_gazetteer_gpkg(path, places=None):
+    """
+    Write places, their geometries, names, locations and descriptions to a single GeoPackage at path. Each table is
+    read with one flat query (geometries as WKB straight from PostGIS) and copied in batches, so the number of queries
+    is fixed and no model instances are built. Pass a Place queryset to restrict the export to those places.
+    Returns a dict of table name to row count.
+    """
+    def scope(queryset, lookup='place__in'):
+        if places is None:
+            return queryset
+        return queryset.filter(**{lookup: places.values('pk')})
+
+    counts = {}
+    db = sqlite3.connect(path)
+    try:
+        db.execute('PRAGMA journal_mode = OFF')
+        db.execute('PRAGMA synchronous = OFF')
+        _gpkg_init(db)
+
+        rows = scope(Place.objects.all(), 'pk__in').annotate(
+            place_name=canonical_name('canonical_name'),
+            area_names=StringAgg('areas__name', delimiter='; ', distinct=True),
+        ).values_list('pk', 'place_name', 'featuretype__name', 'area_names', 'last_modified').order_by('pk')
+        counts['places'] = _gpkg_write_table(db, 'places', [
+            ('fid', 'INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL'),
+            ('name', 'TEXT'),
+            ('featuretype', 'TEXT'),
+            ('areas', 'TEXT'),
+            ('last_modified', 'DATETIME'),
+        ], rows.iterator(), transform=lambda r: r[:4] + (r[4].isoformat() if r[4] else None,))
+
+        for table, model, geometry_type in GPKG_GEOMETRY_LAYERS:
+            rows = scope(model.objects.all()).annotate(
+                wkb=Func(F('geom'), function='ST_AsBinary', output_field=BinaryField()),
+                place_name=canonical_name('place__canonical_name'),
+            ).values_list('pk', 'wkb', 'place_id', 'place_name', 'place__featuretype__name', 'canonical', 'invented',
+                          'sdr_id', 'sdr__name_short', 'pagenumbers').order_by('pk')
+            counts[table] = _gpkg_write_table(db, table, [
+                ('fid', 'INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL'),
+                ('geom', geometry_type),
+                ('place_id', 'INTEGER'),
+                ('place', 'TEXT'),
+                ('featuretype', 'TEXT'),
+                ('canonical', 'BOOLEAN'),
+                ('invented', 'BOOLEAN'),
+            ] + GPKG_SOURCE_COLUMNS, rows.iterator(), geometry_type,
+                transform=lambda r: (r[0], _gpkg_geometry(r[1])) + r[2:])
+
+        rows = scope(Placename.objects.all()).values_list(
+            'pk', 'place_id', 'name', 'language__name', 'canonical', 'invented', 'sdr_id', 'sdr__name_short',
+            'pagenumbers').order_by('pk')
+        counts['placenames'] = _gpkg_write_table(db, 'placenames', [
+            ('fid', 'INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL'),
+            ('place_id', 'INTEGER'),
+            ('name', 'TEXT'),
+            ('language', 'TEXT'),
+            ('canonical', 'BOOLEAN'),
+            ('invented', 'BOOLEAN'),
+        ] + GPKG_SOURCE_COLUMNS, rows.iterator())
+
+        for table, model, text_field in (('locations', Location, 'location'),
+                                         ('descriptions', Description, 'description')):
+            rows = scope(model.objects.all()).values_list(
+                'pk', 'place_id', text_field, 'sdr_id', 'sdr__name_short', 'pagenumbers').order_by('pk')
+            counts[table] = _gpkg_write_table(db, table, [
+                ('fid', 'INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL'),
+                ('place_id', 'INTEGER'),
+                (text_field, 'TEXT'),
+            ] + GPKG_SOURCE_COLUMNS, rows.iterator())
+
+        db.commit()
+    finally:
+        db.close()
+    return counts
+
+
+def export_gpkg(modeladmin, request, queryset):
+    handle, path = tempfile.mkstemp(suffix='.gpkg')
+    os.close(handle)
+    try:
+        write_gazetteer_gpkg(path, queryset)
+        gpkg = open(path, 'rb')
+    finally:
+        # The open handle keeps the file readable while FileResponse streams it
+        os.remove(path)
+
+    response = FileResponse(gpkg, content_type='application/geopackage+sqlite3')
+    response['Content-Disposition'] = 'attachment; filename=%s' % get_export_filename(queryset, 'gpkg')
+    return response
+
+
+export_gpkg.short_description = 'Export selected %(verbose_name_plural)s to GeoPackage'
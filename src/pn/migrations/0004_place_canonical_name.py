@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pn', '0003_place_related_places'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='canonical_name',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255, verbose_name='name'),
+        ),
+        migrations.RunSQL(
+            'UPDATE pn_place SET canonical_name = COALESCE((SELECT name FROM pn_placename '
+            'WHERE pn_placename.place_id = pn_place.id AND pn_placename.canonical = TRUE LIMIT 1), \'\')',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,40 +1,28 @@
 from django.contrib.gis.db import models
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ValidationError
+from django.db import connection, transaction
 from django.db.models import F
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from app.utils import ensure_canonical
+from exports.models import ExportCache
 from sdr.models import DefFeatureType, DefArea, Sdr
 
 
-class PlaceManager(models.Manager):
-    # The extra() call adds the canonical placename to the queryset at the db level, so that admin can sort by it
-    def get_queryset(self):
-        qs = super(PlaceManager, self).get_queryset().extra(
-            select={
-                'place__name': 'COALESCE((SELECT name FROM pn_placename WHERE pn_placename.place_id = pn_place.id '
-                               'AND pn_placename.canonical = TRUE), pn_place.id::varchar(255))'
-            },
-        )
-        return qs
+# noinspection PyProtectedMember
+def sorted_by_name(manager):
+    # Use the rows loaded by prefetch_related() if there are any; otherwise let the database sort them
+    qs = manager.all()
+    if qs._result_cache is not None:
+        return sorted(qs, key=lambda obj: obj.name)
+    return qs.order_by('name')
 
 
-class PlaceGeomManager(models.Manager):
-    _geom = None
-
-    def get_queryset(self):
-        qs = super(PlaceGeomManager, self).get_queryset().extra(
-            select={
-                '{0}__name'.format(self._geom): 'COALESCE((SELECT name || \' \' || pn_place{0}.id::text '
-                                                'FROM pn_placename, pn_place WHERE '
-                                                'pn_placename.place_id = pn_place.id AND '
-                                                'pn_place{0}.place_id = pn_place.id AND '
-                                                'pn_placename.canonical = TRUE), '
-                                                'pn_place{0}.id::varchar(255))'.format(self._geom)
-            },
-        )
-        return qs
+# Empty for places without a canonical placename; __str__ falls back to the id for display
+CANONICAL_NAME_SQL = 'UPDATE pn_place SET canonical_name = COALESCE((SELECT name FROM pn_placename ' \
+                     'WHERE pn_placename.place_id = pn_place.id AND pn_placename.canonical = TRUE LIMIT 1), \'\') ' \
+                     'WHERE pn_place.id = ANY(%s)'
 
 
 class Place(models.Model):
@@ -42,23 +30,28 @@ class Place(models.Model):
     areas = models.ManyToManyField(DefArea)
     last_modified = models.DateTimeField(auto_now=True, verbose_name='last modified')
     related_places = models.ManyToManyField('self')
+    # Denormalized name of the canonical placename, kept in sync by Placename so lists can sort and search on it
+    canonical_name = models.CharField(max_length=255, blank=True, db_index=True, editable=False,
+                                      verbose_name='name')
+
+    @classmethod
+    def update_canonical_names(cls, *place_ids):
+        # A single UPDATE, without touching last_modified. That also skips post_save, so cached place exports
+        # (which include the name) are dropped here.
+        place_ids = [pk for pk in place_ids if pk is not None]
+        if place_ids:
+            with connection.cursor() as cursor:
+                cursor.execute(CANONICAL_NAME_SQL, [place_ids])
+            ExportCache.invalidate(cls._meta.label_lower)
 
     # noinspection PyProtectedMember
     def setnames(self):
         if hasattr(self, '_placenames'):  # Test to see whether we've already set internal multiples (and hit db)
             return
-        self._name = None
         self._placenames = None
         self._placenames_export = None
 
-        placenames = self.placename_set.all().order_by('name')
-        # TODO: Refactor: this essentially reproduces the extra() queryset customization above
-        canonical_placenames = [cp for cp in placenames if cp.canonical]
-        if len(canonical_placenames) > 0:
-            self._name = canonical_placenames[0].name
-        else:
-            self._name = str(self.id)
-
+        placenames = sorted_by_name(self.placename_set)
         linked_names = []
         for pn in placenames:
             # link = reverse('admin:%s_%s_change' % (Placename._meta.app_label, Placename._meta.model_name),
@@ -75,44 +68,39 @@ class Place(models.Model):
         self._area_list = None
         self._area_list_export = None
 
-        areas = [area.name for area in self.areas.all().order_by('name')]
+        areas = [area.name for area in sorted_by_name(self.areas)]
         self._area_list = mark_safe('<br />'.join(areas))
         self._area_list_export = self._area_list.replace('<br />', "\n")
 
     def name(self):
-        self.setnames()
-        return self._name
+        return self.canonical_name
 
     def placenames(self):
         self.setnames()
         return self._placenames
     placenames.short_description = 'place names'
+    placenames.prefetch_related = ('placename_set',)
 
     def placenames_export(self):
         self.setnames()
         return self._placenames_export
     placenames_export.short_description = 'place names'
+    placenames_export.prefetch_related = ('placename_set',)
 
     def area_list(self):
         self.setareas()
         return self._area_list
     area_list.short_description = 'areas'
+    area_list.prefetch_related = ('areas',)
 
     def area_list_export(self):
         self.setareas()
         return self._area_list_export
     area_list_export.short_description = 'areas'
-
-    objects = PlaceManager()
+    area_list_export.prefetch_related = ('areas',)
 
     def __str__(self):
-        # If __str__ is accessed via its queryset, just return the placename gotten via extra()
-        # Otherwise, go through name() to get the related canonical name
-        try:
-            return self.place__name
-        except:
-            name = str(self.name())
-            return name
+        return self.canonical_name or str(self.id)
 
     class Meta:
         ordering = ['-last_modified']
@@ -224,13 +212,40 @@ class Placename(CanonicalModel):
     objects = PlacenameManager()
     parent = Place
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Placename, cls).from_db(db, field_names, values)
+        instance._loaded_place_id = instance.place_id if 'place_id' in field_names else None
+        return instance
+
+    # Every write updates Place.canonical_name in the same transaction, including the sibling saves made by
+    # ensure_canonical (which go through save_simple)
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super(Placename, self).save(*args, **kwargs)
+            self.update_place_names()
+
+    def save_simple(self, *args, **kwargs):
+        with transaction.atomic():
+            super(Placename, self).save_simple(*args, **kwargs)
+            self.update_place_names()
+
+    def update_place_names(self):
+        # a placename moved to another place changes the name of the place it came from too
+        previous = getattr(self, '_loaded_place_id', None)
+        Place.update_canonical_names(self.place_id, previous if previous != self.place_id else None)
+        self._loaded_place_id = self.place_id
+
     def delete(self, *args, **kwargs):
-        parent, siblings = self.get_family()
-        super(Placename, self).delete(*args, **kwargs)
+        with transaction.atomic():
+            parent, siblings = self.get_family()
+            super(Placename, self).delete(*args, **kwargs)
 
-        # If this is the only placename for its place, delete the associated place
-        if siblings.count() == 0:
-            parent.delete()
+            # If this is the only placename for its place, delete the associated place
+            if siblings.count() == 0:
+                parent.delete()
+            else:
+                Place.update_canonical_names(parent.pk)
 
     def __str__(self):
         return str(self.name)
@@ -241,10 +256,6 @@ class Placename(CanonicalModel):
         ordering = ['name']
 
 
-class PlacePointManager(PlaceGeomManager):
-    _geom = 'point'
-
-
 class PlacePoint(CanonicalModel):
     place = models.ForeignKey(Place, on_delete=models.CASCADE)
     geom = models.MultiPointField(geography=True)
@@ -255,20 +266,14 @@ class PlacePoint(CanonicalModel):
 
     parent = Place
 
-    objects = PlacePointManager()
-
     def __str__(self):
-        return str('%s %s' % (self.place.name(), self.pk))
+        return str('%s %s' % (self.place, self.pk))
 
     class Meta:
         verbose_name = 'place point'
         verbose_name_plural = 'place points'
 
 
-class PlaceLineManager(PlaceGeomManager):
-    _geom = 'line'
-
-
 class PlaceLine(CanonicalModel):
     place = models.ForeignKey(Place, on_delete=models.CASCADE)
     geom = models.MultiLineStringField(geography=True)
@@ -279,20 +284,14 @@ class PlaceLine(CanonicalModel):
 
     parent = Place
 
-    objects = PlaceLineManager()
-
     def __str__(self):
-        return str('%s %s' % (self.place.name(), self.pk))
+        return str('%s %s' % (self.place, self.pk))
 
     class Meta:
         verbose_name = 'place line'
         verbose_name_plural = 'place lines'
 
 
-class PlacePolygonManager(PlaceGeomManager):
-    _geom = 'polygon'
-
-
 class PlacePolygon(CanonicalModel):
     place = models.ForeignKey(Place, on_delete=models.CASCADE)
     geom = models.MultiPolygonField(geography=True)
@@ -303,10 +302,8 @@ class PlacePolygon(CanonicalModel):
 
     parent = Place
 
-    objects = PlacePolygonManager()
-
     def __str__(self):
-        return str('%s %s' % (self.place.name(), self.pk))
+        return str('%s %s' % (self.place, self.pk))
 
     class Meta:
         verbose_name = 'place polygon'
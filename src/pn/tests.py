@@ -0,0 +1,56 @@
+from django.test import TestCase
+from sdr.models import Sdr, DefType, DefAccuracyLocation, DefAccuracySize, DefAccuracyGeoref, DefFeatureType
+from .models import Place, Placename, Language
+
+
+class CanonicalNameSyncTest(TestCase):
+    def setUp(self):
+        self.sdr = Sdr.objects.create(
+            zotero='ABCD1234', name_short='Viele map', sdr_year=1865, type=DefType.objects.create(name='map'),
+            sdraccloc=DefAccuracyLocation.objects.create(name='good'),
+            sdraccsiz=DefAccuracySize.objects.create(name='good'),
+            sdraccgeo=DefAccuracyGeoref.objects.create(name='good'))
+        self.language = Language.objects.create(name='English')
+        self.featuretype = DefFeatureType.objects.create(name='streams')
+        self.place = Place.objects.create(featuretype=self.featuretype)
+
+    def add_name(self, name, place=None, canonical=False):
+        placename = Placename(place=place or self.place, language=self.language, name=name, sdr=self.sdr,
+                              pagenumbers='1', canonical=canonical)
+        placename.save()
+        return placename
+
+    def canonical_name(self, place=None):
+        return Place.objects.get(pk=(place or self.place).pk).canonical_name
+
+    def test_first_name_becomes_canonical(self):
+        self.add_name('Minetta Brook')
+        self.assertEqual(self.canonical_name(), 'Minetta Brook')
+
+    def test_new_canonical_name_replaces_the_old(self):
+        self.add_name('Minetta Brook')
+        self.add_name('Manetta Water', canonical=True)
+        self.assertEqual(self.canonical_name(), 'Manetta Water')
+
+    def test_renamed_canonical_name(self):
+        placename = self.add_name('Minetta Brook')
+        placename = Placename.objects.get(pk=placename.pk)
+        placename.name = 'Minetta Creek'
+        placename.save()
+        self.assertEqual(self.canonical_name(), 'Minetta Creek')
+
+    def test_deleted_canonical_name_passes_to_sibling(self):
+        first = self.add_name('Minetta Brook')
+        self.add_name('Manetta Water')
+        Placename.objects.get(pk=first.pk).delete()
+        self.assertEqual(self.canonical_name(), 'Manetta Water')
+
+    def test_name_moved_to_another_place(self):
+        placename = self.add_name('Minetta Brook')
+        other = Place.objects.create(featuretype=self.featuretype)
+        placename = Placename.objects.get(pk=placename.pk)
+        placename.place = other
+        placename.save()
+        self.assertEqual(self.canonical_name(other), 'Minetta Brook')
+        self.assertEqual(self.canonical_name(), '')
+        self.assertEqual(str(Place.objects.get(pk=self.place.pk)), str(self.place.pk))
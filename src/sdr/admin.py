@@ -1,5 +1,18 @@
+import itertools
+import re
+from django.conf.urls import url
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.gis.geos import Point, Polygon
+from django.core.exceptions import PermissionDenied
 from django.forms import ModelForm, NumberInput, CheckboxSelectMultiple
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
 from .models import *
+from .reports import sdr_inventory, INVENTORY_COLUMNS
+from .uploads import ResumableFileField, ResumableFileInput
+from .processing import thumbnail_name, tiles_dir, dzi_xml
+from app.media import change_permission, media_response, media_url
 from pn.models import Placename, Place
 from django.conf import settings
 
@@ -18,19 +31,41 @@ class DefTypeAdmin(SdrBaseAdmin):
     pass
 
 
+# Models that get thumbnails and tile pyramids (see sdr.processing)
+IMAGE_MODELS = (Scan, Georef)
+
+
 class QaInline(SdrTabularInline):
 
     def __init__(self, *args, **kwargs):
         super(QaInline, self).__init__(*args, **kwargs)
+        self.formfield_overrides[models.FileField] = {'form_class': ResumableFileField, 'widget': ResumableFileInput}
+        if self.model in IMAGE_MODELS:
+            self.readonly_fields += ('preview',)
         admin_qs = User.objects.filter(groups__name=settings.QA_GROUP_NAME).distinct()
         self.qa_processors = [(a.pk, str(a)) for a in admin_qs]
 
+    def formfield_for_dbfield(self, db_field, request, **kwargs):
+        # resumable uploads can only be attached by the user who uploaded them
+        if isinstance(db_field, models.FileField):
+            kwargs['user'] = request.user
+        return super(QaInline, self).formfield_for_dbfield(db_field, request, **kwargs)
+
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         field = super(QaInline, self).formfield_for_foreignkey(db_field, request, **kwargs)
         if db_field.name == 'qa_processor' and hasattr(self, 'qa_processors'):
             field.choices = self.qa_processors
         return field
 
+    def preview(self, obj):
+        if obj is None or obj.pk is None or not obj.file:
+            return ''
+        args = (obj._meta.model_name, obj.pk)
+        return format_html(
+            '<a href="{0}" target="_blank"><img src="{1}" style="max-height: 64px;" alt="" '
+            'onerror="this.style.display=\'none\'"></a>',
+            reverse('admin:sdr_sdr_viewer', args=args), reverse('admin:sdr_sdr_tiles', args=args + ('thumbnail.jpg',)))
+
 
 class ScanInline(QaInline):
     model = Scan
@@ -49,6 +84,16 @@ class GeorefInline(QaInline):
         models.DecimalField: {'widget': NumberInput(attrs={'style': 'width: 50px;'})},
     }
 
+    def __init__(self, *args, **kwargs):
+        super(GeorefInline, self).__init__(*args, **kwargs)
+        self.readonly_fields += ('cog_link',)
+
+    def cog_link(self, obj):
+        if obj is None or not obj.cog:
+            return ''
+        return format_html('<a href="{0}">{1} MB</a>', media_url(obj.cog.name), round(obj.cog_size / 1024.0 ** 2, 1))
+    cog_link.short_description = 'COG'
+
 
 class FeatureInline(QaInline):
     model = Feature
@@ -77,6 +122,47 @@ class PlacenameInline(SdrTabularInline):
         return False
 
 
+def coverage_geometry(value):
+    """
+    GEOS geometry for 'lon,lat' (a point) or 'minlon,minlat,maxlon,maxlat' (a bbox), in WGS84. Raises ValueError for
+    anything else.
+    """
+    coords = [float(c) for c in value.split(',')]
+    if len(coords) == 2:
+        return Point(*coords, srid=4326)
+    if len(coords) == 4:
+        if coords[0] >= coords[2] or coords[1] >= coords[3]:
+            raise ValueError('bbox must be minlon,minlat,maxlon,maxlat')
+        return Polygon.from_bbox(coords)
+    raise ValueError('expected lon,lat or minlon,minlat,maxlon,maxlat')
+
+
+class CoverageFilter(admin.SimpleListFilter):
+    title = 'covers'
+    parameter_name = 'covers'
+    template = 'admin/sdr/coverage_filter.html'
+
+    def __init__(self, request, params, model, model_admin):
+        super(CoverageFilter, self).__init__(request, params, model, model_admin)
+        # the filter is a free-text form, so it has to carry the other active filters along itself
+        self.other_params = sorted((k, v) for k, v in request.GET.items() if k != self.parameter_name)
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value():
+            try:
+                geometry = coverage_geometry(self.value())
+            except ValueError as e:
+                raise IncorrectLookupParameters(e)
+            return queryset.covering(geometry)
+        return queryset
+
+
 class SdrAdminForm(ModelForm):
     class Meta:
         model = Sdr
@@ -94,26 +180,17 @@ class SdrAdminForm(ModelForm):
 class SdrAdmin(ReferenceAdmin):
     form = SdrAdminForm
 
+    # Counts are annotated by SdrManager, so the changelist doesn't query per row
     def scans(self, obj):
-        count = Scan.objects.filter(sdr=obj).count()
-        if count is not None:
-            return count
-        return 0
+        return obj.scans
     scans.admin_order_field = 'scans'
 
     def images(self, obj):
-        count = Georef.objects.filter(sdr=obj).count()
-        if count is not None:
-            return count
-        return 0
+        return obj.images
     images.admin_order_field = 'images'
 
     def features(self, obj):
-        count = Feature.objects.filter(sdr=obj).count()
-        if count is not None:
-            count = 0
-        total = obj.intended_features.count()
-        return '%s / %s' % (count, total)
+        return '%s / %s' % (obj.features, obj.intended_features_count)
     features.admin_order_field = 'features'
 
     list_display = (
@@ -121,7 +198,7 @@ class SdrAdmin(ReferenceAdmin):
     list_display_links = ('id', 'name_short')
     # TODO: from-year to-year search fields
     search_fields = ['id', 'name_short', 'zotero']
-    list_filter = ('areas', 'intended_features', 'type')
+    list_filter = (CoverageFilter, 'areas', 'intended_features', 'type')
     # avoiding 'id' in first column because http://annalear.ca/2010/06/10/why-excel-thinks-your-csv-is-a-sylk/
     exportable_fields = ['name_short', 'id', 'zotero', 'sdr_year', 'type', 'scans', 'images', 'features',
                          'last_modified_formatted']
@@ -137,6 +214,130 @@ class SdrAdmin(ReferenceAdmin):
 
     inlines = [ScanInline, GeorefInline, FeatureInline, PlacenameInline]
 
+    def save_model(self, request, obj, form, change):
+        super(SdrAdmin, self).save_model(request, obj, form, change)
+        if obj.renamed_files:
+            self.message_user(request, 'Renamed %s file(s) to match the new short name.' % obj.renamed_files)
+
+    def get_urls(self):
+        urls = [
+            url(r'^inventory/$', self.admin_site.admin_view(self.inventory_view), name='sdr_sdr_inventory'),
+            url(r'^viewer/(?P<resource>scan|georef)/(?P<pk>\d+)/$', self.admin_site.admin_view(self.viewer_view),
+                name='sdr_sdr_viewer'),
+            url(r'^tiles/(?P<resource>scan|georef)/(?P<pk>\d+)/(?P<path>.+)$',
+                self.admin_site.admin_view(self.tiles_view), name='sdr_sdr_tiles'),
+            url(r'^coverage/$', self.admin_site.admin_view(self.coverage_view), name='sdr_sdr_coverage'),
+        ]
+        return urls + super(SdrAdmin, self).get_urls()
+
+    def inventory_view(self, request):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        rows = sdr_inventory()
+        if request.GET.get('format') == 'csv':
+            writer = csv.writer(Echo())
+            header = [label for name, label in INVENTORY_COLUMNS]
+            lines = ([row[name] if not isinstance(row[name], list) else '\n'.join(row[name])
+                      for name, label in INVENTORY_COLUMNS] for row in rows)
+            chunks = (writer.writerow(line) for line in itertools.chain([header], lines))
+            response = StreamingHttpResponse(chunks, content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = 'attachment; filename=sdr-inventory_%s.csv' % (
+                datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
+            return response
+
+        context = dict(
+            self.admin_site.each_context(request),
+            title='SDR processing inventory',
+            opts=self.model._meta,
+            rows=rows,
+        )
+        return TemplateResponse(request, 'admin/sdr/sdr/inventory.html', context)
+
+    def get_image(self, request, resource, pk):
+        model = Scan if resource == 'scan' else Georef
+        if not request.user.has_perm(change_permission(model)):
+            raise PermissionDenied
+        obj = get_object_or_404(model.objects.select_related('sdr'), pk=pk)
+        if not obj.file:
+            raise Http404('No file')
+        return obj
+
+    def viewer_view(self, request, resource, pk):
+        obj = self.get_image(request, resource, pk)
+        context = dict(
+            self.admin_site.each_context(request),
+            title='%s %s' % (obj._meta.verbose_name, obj),
+            opts=self.model._meta,
+            obj=obj,
+            download_url=media_url(obj.file.name),
+            dzi_url=reverse('admin:sdr_sdr_tiles', args=(resource, pk, 'image.dzi')),
+            derivatives=ProcessingTask.latest(obj, 'image_derivatives'),
+        )
+        return TemplateResponse(request, 'admin/sdr/sdr/viewer.html', context)
+
+    def tiles_view(self, request, resource, pk, path):
+        # Derivatives are found from the record they belong to, and handed off like any media download (to nginx, or
+        # a presigned S3 url), so only the tiles in view are ever fetched and each takes one short request here
+        obj = self.get_image(request, resource, pk)
+        if path == 'thumbnail.jpg':
+            name = thumbnail_name(obj.file.name)
+        elif path == 'image.dzi':
+            # Served here rather than redirected: the viewer fetches it with XHR, which cross-origin needs CORS
+            task = ProcessingTask.latest(obj, 'image_derivatives')
+            if task is None or task.status != ProcessingTask.DONE or task.result.get('file') != obj.file.name:
+                raise Http404('Tiles not generated yet')
+            return HttpResponse(dzi_xml(task.result['width'], task.result['height']), content_type='application/xml')
+        elif re.match(r'^image_files/\d+/\d+_\d+\.jpg$', path):
+            name = '%s/%s' % (tiles_dir(obj.file.name), path[len('image_files/'):])
+        else:
+            raise Http404('Unknown derivative')
+        return media_response(request, name, obj.file.storage)
+
+    def coverage_view(self, request):
+        """
+        SDRs covering ?point=lon,lat or ?bbox=minlon,minlat,maxlon,maxlat, with the georefs and features whose
+        footprints intersect it.
+        """
+        if not self.has_change_permission(request):
+            return JsonResponse({'error': 'You do not have permission to view SDRs.'}, status=403)
+        value = request.GET.get('point') or request.GET.get('bbox')
+        try:
+            geometry = coverage_geometry(value or '')
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        sdrs = {}
+        for model, key in ((Georef, 'georefs'), (Feature, 'features')):
+            for pk, sdr_id in model.objects.filter(footprint__intersects=geometry).values_list('pk', 'sdr_id'):
+                sdrs.setdefault(sdr_id, {'georefs': [], 'features': []})[key].append(pk)
+        results = [
+            dict(sdrs[sdr.pk], id=sdr.pk, name_short=sdr.name_short, sdr_year=sdr.sdr_year,
+                 url=reverse('admin:sdr_sdr_change', args=(sdr.pk,)))
+            for sdr in Sdr.objects.filter(pk__in=sdrs).only('pk', 'name_short', 'sdr_year').order_by('pk')]
+        return JsonResponse({'count': len(results), 'results': results})
+
+
+def requeue_processing_tasks(modeladmin, request, queryset):
+    updated = queryset.exclude(status=ProcessingTask.QUEUED).update(
+        status=ProcessingTask.QUEUED, error='', started=None, finished=None)
+    modeladmin.message_user(request, '%s processing task(s) requeued.' % updated)
+
+
+requeue_processing_tasks.short_description = 'Requeue selected processing tasks'
+
+
+class ProcessingTaskAdmin(SdrBaseAdmin):
+    list_display = ('id', 'task', 'content_type', 'object_id', 'status', 'created', 'finished')
+    list_display_links = ('id', 'task')
+    list_filter = ('status', 'task', 'content_type')
+    actions = (requeue_processing_tasks,)
+    fields = ('task', 'content_type', 'object_id', 'params', 'status', 'result', 'created', 'started', 'finished',
+              'error')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
 
 admin.site.register(DefAccuracyGeoref)
 admin.site.register(DefAccuracyLocation)
@@ -150,3 +351,4 @@ admin.site.register(DefArea, DefAreaAdmin)
 admin.site.register(DefFeatureType, DefFeatureTypeAdmin)
 admin.site.register(DefType, DefTypeAdmin)
 admin.site.register(Sdr, SdrAdmin)
+admin.site.register(ProcessingTask, ProcessingTaskAdmin)
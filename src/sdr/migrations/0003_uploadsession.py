@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('sdr', '0002_auto_20180309_2231'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('name', models.CharField(help_text='storage name the file is assembled at', max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('chunk_size', models.IntegerField(default=8388608)),
+                ('s3_upload_id', models.CharField(blank=True, max_length=255)),
+                ('chunks', django.contrib.postgres.fields.jsonb.JSONField(
+                    default=dict, help_text='received chunks: {index: {sha256, etag}}')),
+                ('status', models.CharField(choices=[('open', 'open'), ('complete', 'complete'),
+                                                     ('aborted', 'aborted')],
+                                            db_index=True, default='open', max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('last_modified', models.DateTimeField(auto_now=True)),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                 to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
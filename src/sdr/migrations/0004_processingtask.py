@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('sdr', '0003_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('task', models.CharField(db_index=True, max_length=50)),
+                ('params', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'),
+                                                     ('failed', 'failed')],
+                                            db_index=True, default='queued', max_length=10)),
+                ('result', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                   to='contenttypes.ContentType', verbose_name='resource type')),
+            ],
+            options={
+                'verbose_name': 'processing task',
+                'verbose_name_plural': 'processing tasks',
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='processingtask',
+            index_together=set([('content_type', 'object_id')]),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sdr', '0004_processingtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feature',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, verbose_name='block hash'),
+        ),
+        migrations.AddField(
+            model_name='georef',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, verbose_name='block hash'),
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, verbose_name='block hash'),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, verbose_name='block hash'),
+        ),
+    ]
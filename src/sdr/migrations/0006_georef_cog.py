@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import sdr.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sdr', '0005_content_hashes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='georef',
+            name='cog',
+            field=models.FileField(blank=True, editable=False, null=True, upload_to=sdr.models.cog_name,
+                                   verbose_name='cloud-optimized GeoTIFF'),
+        ),
+        migrations.AddField(
+            model_name='georef',
+            name='cog_size',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, verbose_name='COG size (bytes)'),
+        ),
+        migrations.AddField(
+            model_name='georef',
+            name='cog_seconds',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='COG conversion time (s)'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sdr', '0006_georef_cog'),
+    ]
+
+    # spatial_index (the default) gives each column a GiST index
+    operations = [
+        migrations.AddField(
+            model_name='feature',
+            name='footprint',
+            field=django.contrib.gis.db.models.fields.PolygonField(blank=True, editable=False, geography=True,
+                                                                   null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='georef',
+            name='footprint',
+            field=django.contrib.gis.db.models.fields.PolygonField(blank=True, editable=False, geography=True,
+                                                                   null=True, srid=4326),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sdr', '0007_footprints'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadsession',
+            name='status',
+            field=models.CharField(choices=[('open', 'open'), ('complete', 'complete'), ('attached', 'attached'),
+                                            ('aborted', 'aborted')],
+                                   db_index=True, default='open', max_length=10),
+        ),
+    ]
@@ -1,12 +1,24 @@
+import hashlib
 import os
+import uuid
 from django.contrib.gis.db import models
-from django.db.models import Count
+from django.contrib.postgres.fields import JSONField
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Case, CharField, Count, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django_cleanup.signals import cleanup_pre_delete
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
 from django.utils.text import get_valid_filename, Truncator
-from django.core.files import storage
 from app.utils import *
-import boto3
-import botocore
+from exports.models import ExportCache
+from app.storage import (move_files, s3_client, is_s3_storage, content_hash, content_hash_from_blocks,
+                         FileMoveError, FAILED, MOVED, CONTENT_HASH_BLOCK_SIZE)
 
 
 class DefFeatureType(models.Model):
@@ -112,12 +124,33 @@ class DefType(models.Model):
 
 
 # http://blog.endpoint.com/2013/09/getting-django-admin-to-sort-modified.html
-class SdrManager(models.Manager):
+def count_subquery(queryset, fk):
+    """
+    Correlated COUNT(*) of queryset rows pointing at the outer row through fk. Unlike Count() over joins this doesn't
+    multiply rows when several child tables are counted, and each count is an index scan on the fk column.
+    """
+    counts = queryset.filter(**{fk: OuterRef('pk')}).order_by().values(fk).annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class SdrQuerySet(models.QuerySet):
+    def covering(self, geometry):
+        """
+        SDRs with a georeferenced image or digitized feature whose footprint intersects geometry (a GEOS geometry
+        in WGS84). Each footprint test is a GiST index scan; IN subqueries avoid duplicate SDR rows.
+        """
+        return self.filter(
+            Q(pk__in=Georef.objects.filter(footprint__intersects=geometry).values('sdr')) |
+            Q(pk__in=Feature.objects.filter(footprint__intersects=geometry).values('sdr')))
+
+
+class SdrManager(models.Manager.from_queryset(SdrQuerySet)):
     def get_queryset(self):
         qs = super(SdrManager, self).get_queryset().annotate(
-            scans=Count('scan'),
-            images=Count('georef'),
-            features=Count('feature'),
+            scans=count_subquery(Scan.objects.all(), 'sdr'),
+            images=count_subquery(Georef.objects.all(), 'sdr'),
+            features=count_subquery(Feature.objects.all(), 'sdr'),
+            intended_features_count=count_subquery(Sdr.intended_features.through.objects.all(), 'sdr'),
         )
         return qs
 
@@ -140,15 +173,71 @@ class Sdr(models.Model):
 
     objects = SdrManager()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Sdr, cls).from_db(db, field_names, values)
+        # Remember the stored name so save() only renames child files when it changes
+        instance._loaded_name_short = instance.name_short
+        return instance
+
+    def name_changed(self):
+        # Instances not loaded from the db (e.g. built with an explicit pk) can't tell, so assume a change
+        return self.pk is not None and getattr(self, '_loaded_name_short', None) != self.name_short
+
     def save(self, *args, **kwargs):
+        name_changed = self.name_changed()
         super(Sdr, self).save(*args, **kwargs)
-        # Save every child object to ensure filenames stay consistent with SDR name
-        for s in self.scan_set.all():
-            s.save()
-        for g in self.georef_set.all():
-            g.save()
-        for f in self.feature_set.all():
-            f.save()
+        self.renamed_files = 0
+        # Child filenames include the SDR name, so they only need updating when it changes
+        if name_changed:
+            self.renamed_files = self.rename_files()
+        self._loaded_name_short = self.name_short
+
+    def rename_files(self, progress=None):
+        """
+        Rename every child file to match the current SDR name. Files are moved concurrently (see app.storage), then
+        each child table gets a single UPDATE in one transaction; if any move or the UPDATE fails, files already
+        moved are moved back. Children are not re-saved, so there's no per-row SELECT or save signal.
+        progress(done, total) is called as moves finish. Returns the number of files renamed.
+        """
+        renames = []
+        for children in (self.scan_set.all(), self.georef_set.all(), self.feature_set.select_related('featuretype')):
+            for child in children.exclude(file='').exclude(file__isnull=True).order_by('pk'):
+                child.sdr = self
+                newname = sdrfile_name(child, child.file.name)
+                if newname != child.file.name:
+                    renames.append((child, child.file.name, newname))
+
+        storage = Scan._meta.get_field('file').storage
+        results = move_files([(oldname, newname) for child, oldname, newname in renames], storage=storage,
+                             progress=progress)
+        moved = [(r.new, r.old) for r in results if r.status == MOVED]
+        try:
+            if any(r.status == FAILED for r in results):
+                raise FileMoveError(results)
+            with transaction.atomic():
+                for model in (Scan, Georef, Feature):
+                    newnames = dict((child.pk, newname) for child, oldname, newname in renames
+                                    if isinstance(child, model))
+                    if newnames:
+                        model.objects.filter(pk__in=newnames.keys()).update(file=Case(
+                            *[When(pk=pk, then=Value(name)) for pk, name in newnames.items()],
+                            output_field=CharField()))
+        except Exception:
+            move_files(moved, storage=storage)
+            raise
+
+        if renames:
+            # update() skips post_save, which is what normally drops cached exports
+            ExportCache.invalidate(self._meta.label_lower)
+        for child, oldname, newname in renames:
+            child.file.name = newname
+            # update() skips post_save, so move image derivatives along explicitly
+            if isinstance(child, (Scan, Georef)):
+                ProcessingTask.enqueue(child, 'image_derivatives', previous=oldname)
+            if isinstance(child, Georef):
+                ProcessingTask.enqueue(child, 'cog')
+        return len(renames)
 
     def __str__(self):
         name = str(self.name_short)
@@ -162,62 +251,203 @@ class Sdr(models.Model):
         ordering = ['-last_modified']
 
 
+CONTENT_ADDRESSED_PREFIX = 'cas/'
+
+
+def content_addressed_name(digest, ext):
+    return '%s%s/%s%s' % (CONTENT_ADDRESSED_PREFIX, digest[:2], digest, ext.lower())
+
+
+def is_content_addressed(name):
+    return bool(name) and name.startswith(CONTENT_ADDRESSED_PREFIX)
+
+
 def sdrfile_name(instance, filename):
+    root, ext = os.path.splitext(filename)
+    # identical content is stored once, under its hash, however many records share it
+    if settings.SDR_CONTENT_ADDRESSED_STORAGE and instance.content_hash:
+        return content_addressed_name(instance.content_hash, ext)
     resourcetype = instance.__class__.__name__.lower()
     if resourcetype == Feature.__name__.lower():
         resourcetype = get_valid_filename(Truncator(instance.featuretype.name).words(4, truncate=''))
-    humanname = get_valid_filename(Truncator(instance.sdr.name_short).words(4, truncate=''))
-    root, ext = os.path.splitext(filename)
-    instancefile = '%s-%s-%s-%s%s' % (instance.sdr_id, humanname, resourcetype, instance.pk, ext)
+    instancefile = '%s%s-%s%s' % (sdrfile_prefix(instance.sdr), resourcetype, instance.pk, ext)
     return instancefile
 
 
-def rename_existing_file(oldfile, newfile):
-    s = storage.get_storage_class()
+def sdrfile_prefix(sdr):
+    # The part of sdrfile_name that comes from the SDR: '<id>-<short name>-'
+    return '%s-%s-' % (sdr.pk, get_valid_filename(Truncator(sdr.name_short).words(4, truncate='')))
+
+
+def cog_name(instance, filename):
+    # next to, and named after, the original
+    return '%s.cog.tif' % os.path.splitext(instance.file.name)[0]
+
+
+def fieldfile(instance, name):
+    return instance.file.field.attr_class(instance, instance.file.field, name)
 
-    classname = s.__name__.split('.')[-1]
-    if classname == 'S3Boto3Storage':
-        s3 = boto3.resource('s3')
-        bucket = settings.AWS_STORAGE_BUCKET_NAME
-        try:
-            s3.Object(bucket, oldfile.name).load()
-            s3.Object(bucket, newfile.name).copy_from(CopySource='%s/%s' % (bucket, oldfile.name))
-            s3.Object(bucket, oldfile.name).delete()
-        except botocore.exceptions.ClientError as e:
-            pass
-    elif classname == 'OverwriteFileSystemStorage' or classname == 'FileSystemStorage':
-        if os.path.isfile(oldfile.path):
-            new_path = os.path.join(settings.MEDIA_ROOT, newfile.name)
-            os.rename(oldfile.path, new_path)
-    else:
-        raise NotImplementedError('Rename existing file not implemented for storage system in use: %s' % classname)
+
+def rename_existing_file(oldfile, newfile):
+    # A missing source is fine: the db just ends up pointing at the new name, as with a fresh upload.
+    # Content-addressed files are never moved: other records may share them, and django_cleanup deletes them once
+    # nothing does (see keep_shared_files). Nor is anything moved over one that's already stored, or over the name a
+    # new upload is about to be saved at.
+    if oldfile.name == newfile.name or is_content_addressed(oldfile.name):
+        return
+    if is_content_addressed(newfile.name) and (not newfile._committed or newfile.storage.exists(newfile.name)):
+        return
+    results = move_files([(oldfile.name, newfile.name)], storage=oldfile.storage)
+    if any(r.status == FAILED for r in results):
+        raise FileMoveError(results)
+
+
+def loaded_sdr_file(instance, field_names):
+    # Called from Scan/Georef/Feature.from_db: remember what the stored filename was derived from, so saves that
+    # don't change any of it can skip re-reading the row and recomputing the name
+    if 'file' in field_names and 'sdr_id' in field_names:
+        instance._loaded_file = (instance.file.name, instance.sdr_id, getattr(instance, 'featuretype_id', None))
+    return instance
+
+
+def sdrfile_unchanged(instance):
+    """
+    Whether the file and everything its name is derived from are as loaded, without any queries. The name also
+    depends on the SDR's short name, which Sdr.rename_files can change (with update()) after this instance was
+    loaded, e.g. when an SDR and its inlines are saved together. The inlines then hold the renamed SDR, so when
+    the SDR is already on the instance the name is checked against it; one that isn't is taken to be as loaded.
+    """
+    loaded = getattr(instance, '_loaded_file', None)
+    if (loaded is None or not instance.file._committed or
+            loaded != (instance.file.name, instance.sdr_id, getattr(instance, 'featuretype_id', None))):
+        return False
+    if is_content_addressed(instance.file.name) or not type(instance).sdr.is_cached(instance):
+        return True
+    return instance.file.name.startswith(sdrfile_prefix(instance.sdr))
+
+
+def pending_content_hash(instance):
+    """
+    Content hash of a newly assigned file: from the hashing upload handler, from the chunk digests of a resumable
+    upload, or failing those by reading the file. Cached on the FieldFile so clean() and save() hash only once.
+    """
+    f = instance.file
+    if not hasattr(f, '_content_hash'):
+        digest = getattr(f.file, 'content_hash', None) if not f._committed else None
+        if digest is None and f._committed:
+            digest = UploadSession.objects.filter(name=f.name).exclude(content_hash='').values_list(
+                'content_hash', flat=True).first()
+        f._content_hash = digest or content_hash(f)
+    return f._content_hash
+
+
+def is_new_file(instance, oldname):
+    return bool(instance.file) and (not instance.file._committed or instance.file.name != oldname)
+
+
+def find_duplicate_file(instance):
+    digest = pending_content_hash(instance)
+    for model in (Scan, Georef, Feature):
+        duplicates = model.objects.filter(content_hash=digest).select_related('sdr')
+        if isinstance(instance, model) and instance.pk is not None:
+            duplicates = duplicates.exclude(pk=instance.pk)
+        duplicate = duplicates.first()
+        if duplicate is not None:
+            return duplicate
+    return None
+
+
+def validate_unique_file(instance):
+    # Called from clean(): with content-addressed storage duplicates are simply shared, otherwise they're refused
+    loaded = getattr(instance, '_loaded_file', None)
+    if settings.SDR_CONTENT_ADDRESSED_STORAGE or not is_new_file(instance, loaded[0] if loaded else None):
+        return
+    duplicate = find_duplicate_file(instance)
+    if duplicate is not None:
+        raise ValidationError({'file': 'This file has already been uploaded as %s %s of %s.' % (
+            duplicate._meta.verbose_name, duplicate.pk, duplicate.sdr)})
+
+
+def use_stored_copy(instance):
+    # Content-addressed mode: if these bytes are already stored, point at them instead of storing another copy
+    if not settings.SDR_CONTENT_ADDRESSED_STORAGE:
+        return
+    name = content_addressed_name(instance.content_hash, os.path.splitext(instance.file.name)[1])
+    storage = instance.file.storage
+    if instance.file.name == name or not storage.exists(name):
+        return
+    if instance.file._committed and UploadSession.objects.filter(name=instance.file.name).exists():
+        storage.delete(instance.file.name)
+    instance.file = name
+
+
+def shared_file_references(name):
+    return (sum(model.objects.filter(file=name).count() for model in (Scan, Georef, Feature)) +
+            Georef.objects.filter(cog=name).count())
 
 
 # noinspection PyUnresolvedReferences
+@transaction.atomic
 def save_sdr_files(instance, *args, **kwargs):
     resourcemodel = instance.__class__
 
+    if not instance.file:
+        instance.content_hash = ''
+
     # adding a new obj. Need to save record first so we have pk for filename.
     if instance.pk is None:
+        if instance.file:
+            if instance.file._committed:
+                UploadSession.attach(instance.file.name)
+            instance.content_hash = pending_content_hash(instance)
+            use_stored_copy(instance)
         file_to_save = instance.file
         instance.file = None
         super(resourcemodel, instance).save(*args, **kwargs)
         instance.file = file_to_save
+        # file already in storage (e.g. an assembled upload) rather than uploaded with the form: move it into place
+        if instance.file and instance.file._committed:
+            newname = sdrfile_name(instance, instance.file.name)
+            rename_existing_file(instance.file, fieldfile(instance, newname))
+            instance.file.name = newname
+
+    # editing existing object whose file is as loaded and still named as it should be
+    elif sdrfile_unchanged(instance):
+        pass
 
     # editing existing object
     else:
-        oldfile = resourcemodel.objects.get(pk=instance.pk).file
-        instance.file.name = sdrfile_name(instance, instance.file.name)
-        # rename existing file; if no new file is uploaded, existing file will be properly named
-        if oldfile.name != instance.file.name:  # SDR name has changed, OR user is replacing file
-            rename_existing_file(oldfile, instance.file)
+        loaded = getattr(instance, '_loaded_file', None)
+        if loaded is not None:
+            oldfile = fieldfile(instance, loaded[0])
+        else:
+            oldfile = resourcemodel.objects.get(pk=instance.pk).file
+        if is_new_file(instance, oldfile.name):
+            if instance.file._committed:
+                UploadSession.attach(instance.file.name)
+            instance.content_hash = pending_content_hash(instance)
+            use_stored_copy(instance)
+        if instance.file and instance.file._committed and instance.file.name != oldfile.name:
+            # replaced by a file already in storage (e.g. a resumable upload): move it over the existing one
+            newname = sdrfile_name(instance, instance.file.name)
+            rename_existing_file(instance.file, fieldfile(instance, newname))
+            instance.file.name = newname
+        elif instance.file:
+            instance.file.name = sdrfile_name(instance, instance.file.name)
+            # rename existing file; if no new file is uploaded, existing file will be properly named
+            if oldfile.name and oldfile.name != instance.file.name:  # SDR/type has changed, OR user is replacing file
+                rename_existing_file(oldfile, instance.file)
 
     super(resourcemodel, instance).save(*args, **kwargs)
+    instance._loaded_file = (instance.file.name, instance.sdr_id, getattr(instance, 'featuretype_id', None))
 
 
 class Feature(models.Model):
     sdr = models.ForeignKey(Sdr, on_delete=models.CASCADE)
     file = models.FileField(upload_to=sdrfile_name, null=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, editable=False, verbose_name='block hash')
+    # WGS84 outline of the file's extent, set by the 'footprint' processing task
+    footprint = models.PolygonField(geography=True, null=True, blank=True, editable=False)
     featuretype = models.ForeignKey(DefFeatureType, verbose_name='feature type', on_delete=models.PROTECT)
     processor = models.ForeignKey(User, related_name='features_processed', verbose_name='processed by',
                                   on_delete=models.PROTECT)
@@ -227,6 +457,13 @@ class Feature(models.Model):
     final = models.BooleanField(default=False)
     last_modified = models.DateTimeField(auto_now=True, verbose_name='last modified')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        return loaded_sdr_file(super(Feature, cls).from_db(db, field_names, values), field_names)
+
+    def clean(self):
+        validate_unique_file(self)
+
     def save(self, *args, **kwargs):
         save_sdr_files(self, *args, **kwargs)
 
@@ -242,6 +479,9 @@ class Feature(models.Model):
 class Georef(models.Model):
     sdr = models.ForeignKey(Sdr, on_delete=models.CASCADE)
     file = models.FileField(upload_to=sdrfile_name, null=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, editable=False, verbose_name='block hash')
+    # WGS84 outline of the file's extent, set by the 'footprint' processing task
+    footprint = models.PolygonField(geography=True, null=True, blank=True, editable=False)
     rectification = models.ForeignKey(DefRectification, on_delete=models.PROTECT)
     control_points = models.SmallIntegerField()
     rms_error = models.DecimalField(max_digits=8, decimal_places=6, verbose_name='RMS error')
@@ -252,6 +492,18 @@ class Georef(models.Model):
     qa_date = models.DateField(null=True, blank=True, verbose_name='QA date')
     final = models.BooleanField(default=False)
     last_modified = models.DateTimeField(auto_now=True, verbose_name='last modified')
+    # Cloud-optimized GeoTIFF made from file by the 'cog' processing task; the original is kept as uploaded
+    cog = models.FileField(upload_to=cog_name, null=True, blank=True, editable=False,
+                           verbose_name='cloud-optimized GeoTIFF')
+    cog_size = models.BigIntegerField(null=True, blank=True, editable=False, verbose_name='COG size (bytes)')
+    cog_seconds = models.FloatField(null=True, blank=True, editable=False, verbose_name='COG conversion time (s)')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        return loaded_sdr_file(super(Georef, cls).from_db(db, field_names, values), field_names)
+
+    def clean(self):
+        validate_unique_file(self)
 
     def save(self, *args, **kwargs):
         save_sdr_files(self, *args, **kwargs)
@@ -270,6 +522,7 @@ class Scan(models.Model):
     # Setting null=True for fields based on CharField is discouraged, but required because of the save() override
     # that saves data before renaming file. I'm not sure why form still requires form input but this is desired anyway.
     file = models.FileField(upload_to=sdrfile_name, null=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, editable=False, verbose_name='block hash')
     resolution = models.ForeignKey(DefResolution, on_delete=models.PROTECT)
     processor = models.ForeignKey(User, related_name='scans_processed', verbose_name='processed by',
                                   on_delete=models.PROTECT)
@@ -279,6 +532,13 @@ class Scan(models.Model):
     final = models.BooleanField(default=False)
     last_modified = models.DateTimeField(auto_now=True, verbose_name='last modified')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        return loaded_sdr_file(super(Scan, cls).from_db(db, field_names, values), field_names)
+
+    def clean(self):
+        validate_unique_file(self)
+
     def save(self, *args, **kwargs):
         save_sdr_files(self, *args, **kwargs)
 
@@ -289,3 +549,270 @@ class Scan(models.Model):
         verbose_name = 'scanned image'
         verbose_name_plural = 'scanned images'
         ordering = ['sdr']
+
+
+# Chunk size for resumable uploads. Also the S3 multipart part size, so it must stay >= 5MB, and the content hash
+# block size, so a completed upload's hash comes straight from its chunk digests.
+UPLOAD_CHUNK_SIZE = CONTENT_HASH_BLOCK_SIZE
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload: the client PUTs fixed-size chunks in any order (retrying any that fail), each written
+    straight into the target storage (an S3 multipart upload part, or at its offset in a sparse file), so the app
+    server holds at most one chunk per request. Once complete, the assembled file can be attached to a Scan,
+    Georef or Feature, and save_sdr_files moves it into place.
+    """
+    OPEN = 'open'
+    COMPLETE = 'complete'
+    ATTACHED = 'attached'
+    ABORTED = 'aborted'
+    STATUS_CHOICES = (
+        (OPEN, 'open'),
+        (COMPLETE, 'complete'),
+        (ATTACHED, 'attached'),
+        (ABORTED, 'aborted'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, help_text='storage name the file is assembled at')
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField(default=UPLOAD_CHUNK_SIZE)
+    s3_upload_id = models.CharField(max_length=255, blank=True)
+    chunks = JSONField(default=dict, help_text='received chunks: {index: {sha256, etag}}')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=OPEN, db_index=True)
+    content_hash = models.CharField(max_length=64, blank=True, verbose_name='block hash')
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+    last_modified = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def start(cls, user, filename, size, storage=None):
+        storage = storage or default_storage
+        session = cls(created_by=user, filename=filename, size=size)
+        # short enough for FileField's max_length; only the extension matters to sdrfile_name
+        session.name = 'uploads/%s%s' % (session.id.hex, os.path.splitext(filename)[1].lower())
+        if is_s3_storage(storage):
+            upload = s3_client().create_multipart_upload(Bucket=storage.bucket_name, Key=session.storage_key(storage))
+            session.s3_upload_id = upload['UploadId']
+        elif hasattr(storage, 'path'):
+            path = storage.path(session.name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        else:
+            raise NotImplementedError('Resumable uploads not implemented for storage system in use: %s' %
+                                      storage.__class__.__name__)
+        session.save()
+        return session
+
+    def storage_key(self, storage):
+        return storage._normalize_name(storage._clean_name(self.name))
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index):
+        if not 0 <= index < self.chunk_count:
+            raise IndexError('chunk %s out of range' % index)
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def received(self):
+        return sorted(int(i) for i in self.chunks)
+
+    def missing(self):
+        return sorted(set(range(self.chunk_count)) - set(self.received()))
+
+    def write_chunk(self, index, data, storage=None):
+        storage = storage or default_storage
+        sha256 = hashlib.sha256(data).hexdigest()
+        etag = ''
+        if is_s3_storage(storage):
+            part = s3_client().upload_part(Bucket=storage.bucket_name, Key=self.storage_key(storage),
+                                           UploadId=self.s3_upload_id, PartNumber=index + 1, Body=data)
+            etag = part['ETag']
+        else:
+            with open(storage.path(self.name), 'r+b') as f:
+                f.seek(index * self.chunk_size)
+                f.write(data)
+
+        # chunks may arrive concurrently, so merge into the locked row rather than overwrite it
+        with transaction.atomic():
+            locked = UploadSession.objects.select_for_update().get(pk=self.pk)
+            locked.chunks[str(index)] = {'sha256': sha256, 'etag': etag}
+            locked.save(update_fields=['chunks', 'last_modified'])
+        self.chunks = locked.chunks
+        return sha256
+
+    def complete(self, storage=None):
+        storage = storage or default_storage
+        if is_s3_storage(storage):
+            parts = [{'PartNumber': i + 1, 'ETag': self.chunks[str(i)]['etag']} for i in range(self.chunk_count)]
+            s3_client().complete_multipart_upload(Bucket=storage.bucket_name, Key=self.storage_key(storage),
+                                                  UploadId=self.s3_upload_id, MultipartUpload={'Parts': parts})
+        self.content_hash = content_hash_from_blocks(self.chunks[str(i)]['sha256'] for i in range(self.chunk_count))
+        self.status = self.COMPLETE
+        self.save(update_fields=['status', 'content_hash', 'last_modified'])
+
+    def abort(self, storage=None):
+        storage = storage or default_storage
+        if self.status == self.OPEN and is_s3_storage(storage):
+            s3_client().abort_multipart_upload(Bucket=storage.bucket_name, Key=self.storage_key(storage),
+                                               UploadId=self.s3_upload_id)
+        else:
+            storage.delete(self.name)
+        self.status = self.ABORTED
+        self.save(update_fields=['status', 'last_modified'])
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Called by save_sdr_files, inside the record's save, for a stored file newly assigned to a record: if it's an
+        upload, mark it attached so it can't be attached again. The UPDATE locks the row, so of two concurrent saves
+        only one claims it.
+        """
+        claimed = cls.objects.filter(name=name, status=cls.COMPLETE).update(
+            status=cls.ATTACHED, last_modified=timezone.now())
+        if not claimed and cls.objects.filter(name=name).exists():
+            raise ValidationError('This upload has already been attached or has expired; please upload it again.')
+
+    def as_json(self):
+        return {
+            'id': str(self.id),
+            'filename': self.filename,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'chunk_count': self.chunk_count,
+            'received': self.received(),
+            'status': self.status,
+        }
+
+    def __str__(self):
+        return '%s (%s)' % (self.filename, self.status)
+
+
+class ProcessingTask(models.Model):
+    """
+    Background work on an SDR file (thumbnails and tiles, format conversion, ...), run by the process_sdr_files
+    worker. Handlers are registered by task name in sdr.processing.TASK_HANDLERS and return a JSON-serializable
+    result; params carries anything the handler needs beyond the object itself, e.g. a previous filename to clean up.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    )
+
+    content_type = models.ForeignKey(ContentType, verbose_name='resource type', on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    task = models.CharField(max_length=50, db_index=True)
+    params = JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    result = JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'processing task'
+        verbose_name_plural = 'processing tasks'
+        ordering = ['-created']
+        index_together = ('content_type', 'object_id')
+
+    def __str__(self):
+        return '%s %s %s' % (self.task, self.content_type.model, self.object_id)
+
+    @classmethod
+    def enqueue(cls, instance, task, **params):
+        return cls.objects.create(content_type=ContentType.objects.get_for_model(instance), object_id=instance.pk,
+                                  task=task, params=params)
+
+    @classmethod
+    def claim_next(cls):
+        # Must be called inside a transaction; skip_locked lets any number of workers poll the same table
+        return cls.objects.select_for_update(skip_locked=True).filter(status=cls.QUEUED).order_by('created').first()
+
+    @classmethod
+    def latest(cls, instance, task):
+        return cls.objects.filter(content_type=ContentType.objects.get_for_model(instance), object_id=instance.pk,
+                                  task=task).order_by('-created').first()
+
+    def get_object(self):
+        # None if the object has since been deleted; handlers that clean up after deletions work from params
+        return self.content_type.model_class()._default_manager.filter(pk=self.object_id).first()
+
+    def run(self):
+        from .processing import TASK_HANDLERS  # processing imports this module
+        self.result = TASK_HANDLERS[self.task](self) or {}
+        self.status = self.DONE
+        self.finished = timezone.now()
+        self.save()
+
+
+SDR_INVENTORY_CACHE_KEY = 'sdr_inventory'
+
+
+@receiver(post_save, sender=Sdr)
+@receiver(post_delete, sender=Sdr)
+@receiver(m2m_changed, sender=Sdr.intended_features.through)
+@receiver(post_save, sender=Scan)
+@receiver(post_delete, sender=Scan)
+@receiver(post_save, sender=Georef)
+@receiver(post_delete, sender=Georef)
+@receiver(post_save, sender=Feature)
+@receiver(post_delete, sender=Feature)
+@receiver(post_save, sender=DefFeatureType)
+@receiver(post_save, sender=DefType)
+def invalidate_sdr_inventory(sender, **kwargs):
+    cache.delete(SDR_INVENTORY_CACHE_KEY)
+
+
+def saved_file_change(instance):
+    """
+    From a post_save receiver: (changed, previous name) for instance.file. _loaded_file still holds the name loaded
+    from the db until save_sdr_files returns.
+    """
+    loaded = getattr(instance, '_loaded_file', None)
+    previous = loaded[0] if loaded else None
+    return bool(instance.file) and instance.file.name != previous, previous
+
+
+@receiver(post_save, sender=Scan)
+@receiver(post_save, sender=Georef)
+def enqueue_image_derivatives(sender, instance, **kwargs):
+    changed, previous = saved_file_change(instance)
+    if changed:
+        ProcessingTask.enqueue(instance, 'image_derivatives', previous=previous)
+        if sender is Georef:
+            ProcessingTask.enqueue(instance, 'cog')
+
+
+@receiver(post_save, sender=Georef)
+@receiver(post_save, sender=Feature)
+def enqueue_footprint(sender, instance, **kwargs):
+    changed, previous = saved_file_change(instance)
+    if changed:
+        ProcessingTask.enqueue(instance, 'footprint')
+
+
+@receiver(post_delete, sender=Scan)
+@receiver(post_delete, sender=Georef)
+def enqueue_derivative_cleanup(sender, instance, **kwargs):
+    if instance.file and not shared_file_references(instance.file.name):
+        ProcessingTask.enqueue(instance, 'delete_derivatives', name=instance.file.name)
+
+
+@receiver(cleanup_pre_delete)
+def keep_shared_files(sender, file, **kwargs):
+    # django_cleanup deletes a file when its record is deleted or its file replaced; a content-addressed file may
+    # still back other records, and FieldFile.delete() is a no-op without a name
+    if is_content_addressed(file.name) and shared_file_references(file.name):
+        file.name = None
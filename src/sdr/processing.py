@@ -0,0 +1,277 @@
+import functools
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from xml.etree import ElementTree
+from django.conf import settings
+from django.contrib.gis.gdal import DataSource, GDALRaster, OGRGeometry
+from django.contrib.gis.geos import MultiPolygon
+from django.core.files import File
+from django.core.files.storage import default_storage
+from app.storage import write_files, delete_prefix
+from .models import Georef, shared_file_references
+
+THUMBNAIL_SIZE = 256
+TILE_SIZE = 254
+TILE_OVERLAP = 1
+TILE_FORMAT = 'jpg'
+TILE_QUALITY = 85
+COG_BLOCK_SIZE = 512
+COG_CREATION_OPTIONS = ('TILED=YES', 'BLOCKXSIZE=%s' % COG_BLOCK_SIZE, 'BLOCKYSIZE=%s' % COG_BLOCK_SIZE,
+                        'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER')
+FOOTPRINT_EDGE_POINTS = 16
+DZI_TEMPLATE = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+               '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="%s" Overlap="%s" TileSize="%s">' \
+               '<Size Width="%s" Height="%s"/></Image>\n'
+
+TASK_HANDLERS = {}
+# Tile pyramids and COGs of large scans are disk and CPU heavy; only this many run at once, whatever the number
+# of worker threads
+HEAVY_TASK_SLOTS = threading.BoundedSemaphore(settings.SDR_PROCESSING_HEAVY_TASKS)
+
+
+def task_handler(name, heavy=False):
+    def register(func):
+        if heavy:
+            @functools.wraps(func)
+            def limited(task):
+                with HEAVY_TASK_SLOTS:
+                    return func(task)
+            TASK_HANDLERS[name] = limited
+        else:
+            TASK_HANDLERS[name] = func
+        return func
+    return register
+
+
+# Derivatives are stored next to the original and named after it (i.e. after its sdrfile_name), so they can be
+# located from the file name alone
+def derivative_root(name):
+    return os.path.splitext(name)[0]
+
+
+def thumbnail_name(name):
+    return '%s.thumb.jpg' % derivative_root(name)
+
+
+def dzi_name(name):
+    return '%s.dzi' % derivative_root(name)
+
+
+def tiles_dir(name):
+    return '%s_files' % derivative_root(name)
+
+
+def derivative_source_root(name):
+    """The derivative_root of the original a thumbnail, DZI, tile or COG name was made from; None for other names."""
+    if '_files/' in name:
+        return name.rsplit('_files/', 1)[0]
+    for suffix in ('.thumb.jpg', '.dzi', '.cog.tif'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return None
+
+
+def delete_derivatives(name, storage):
+    storage.delete(thumbnail_name(name))
+    storage.delete(dzi_name(name))
+    delete_prefix(tiles_dir(name), storage)
+
+
+def dzi_xml(width, height):
+    return DZI_TEMPLATE % (TILE_FORMAT, TILE_OVERLAP, TILE_SIZE, width, height)
+
+
+def open_local_copy(fieldfile):
+    # The command line tools need a seekable file, and a local one keeps S3 originals from being read through the
+    # network twice
+    tmp = tempfile.NamedTemporaryFile(suffix=os.path.splitext(fieldfile.name)[1])
+    with fieldfile.storage.open(fieldfile.name, 'rb') as f:
+        shutil.copyfileobj(f, tmp, 1024 * 1024)
+    tmp.flush()
+    return tmp
+
+
+def dzi_size(path):
+    size = ElementTree.parse(path).getroot().find('{http://schemas.microsoft.com/deepzoom/2008}Size')
+    return int(size.get('Width')), int(size.get('Height'))
+
+
+def local_tiles(local_dir, name):
+    """Yield (storage name, bytes) for the tiles vips wrote under local_dir, one file at a time."""
+    for root, dirs, files in os.walk(local_dir):
+        for filename in files:
+            path = os.path.join(root, filename)
+            with open(path, 'rb') as f:
+                yield '%s/%s' % (tiles_dir(name), os.path.relpath(path, local_dir).replace(os.sep, '/')), f.read()
+
+
+@task_handler('image_derivatives', heavy=True)
+def image_derivatives(task):
+    """
+    Thumbnail and Deep Zoom (DZI) tile pyramid for a Scan or Georef image. Uses the libvips command line tools,
+    which stream the image through in strips rather than decoding it whole, so memory use doesn't grow with the
+    size of the scan.
+    """
+    instance = task.get_object()
+    if instance is None or not instance.file:
+        return {'skipped': 'no file'}
+    name = instance.file.name
+    storage = instance.file.storage
+
+    previous = task.params.get('previous')
+    # content-addressed originals, and so their derivatives, may still be used by other records
+    if previous and previous != name and not shared_file_references(previous):
+        delete_derivatives(previous, storage)
+
+    with open_local_copy(instance.file) as tmp, tempfile.TemporaryDirectory() as tmpdir:
+        pyramid = os.path.join(tmpdir, 'pyramid')
+        thumbnail = os.path.join(tmpdir, 'thumbnail.jpg')
+        run('vips', 'dzsave', tmp.name, pyramid, '--tile-size', str(TILE_SIZE), '--overlap', str(TILE_OVERLAP),
+            '--suffix', '.%s[Q=%s]' % (TILE_FORMAT, TILE_QUALITY))
+        run('vipsthumbnail', tmp.name, '--size', '%sx%s' % (THUMBNAIL_SIZE, THUMBNAIL_SIZE),
+            '-o', '%s[Q=%s]' % (thumbnail, TILE_QUALITY))
+        width, height = dzi_size(pyramid + '.dzi')
+        tiles = write_files(local_tiles(pyramid + '_files', name), storage)
+        with open(thumbnail, 'rb') as f:
+            thumbnail_bytes = f.read()
+
+    write_files([
+        (thumbnail_name(name), thumbnail_bytes),
+        (dzi_name(name), dzi_xml(width, height).encode('utf-8')),
+    ], storage)
+    return {'file': name, 'width': width, 'height': height, 'tiles': tiles}
+
+
+@task_handler('delete_derivatives')
+def remove_derivatives(task):
+    delete_derivatives(task.params['name'], default_storage)
+    return {'deleted': task.params['name']}
+
+
+def run(*args):
+    try:
+        subprocess.check_output(args, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError('%s failed: %s' % (' '.join(args), e.output.decode('utf-8', 'replace')))
+
+
+def overview_levels(width, height):
+    # Halve until the smallest overview fits in a single block
+    levels = []
+    factor = 2
+    while max(width, height) / float(factor // 2) > COG_BLOCK_SIZE:
+        levels.append(str(factor))
+        factor *= 2
+    return levels
+
+
+@task_handler('cog', heavy=True)
+def cloud_optimized_geotiff(task):
+    """
+    Cloud-optimized GeoTIFF of a Georef image: tiled, compressed, with internal overviews and the IFDs ahead of the
+    data, so clients can range-read just the window and zoom level they need. Uses the GDAL command line tools:
+    a tiled copy, gdaladdo overviews, then COPY_SRC_OVERVIEWS to lay them out in COG order.
+    """
+    instance = task.get_object()
+    if instance is None or not instance.file:
+        return {'skipped': 'no file'}
+    storage = instance.cog.storage
+    start = time.time()
+
+    with open_local_copy(instance.file) as src, tempfile.TemporaryDirectory() as tmpdir:
+        raster = GDALRaster(src.name)
+        tiled = os.path.join(tmpdir, 'tiled.tif')
+        cog = os.path.join(tmpdir, 'cog.tif')
+        creation_options = [arg for option in COG_CREATION_OPTIONS for arg in ('-co', option)]
+        run('gdal_translate', '-of', 'GTiff', *(creation_options + [src.name, tiled]))
+        levels = overview_levels(raster.width, raster.height)
+        if levels:
+            run('gdaladdo', '-r', 'average', '--config', 'COMPRESS_OVERVIEW', 'DEFLATE', tiled, *levels)
+        run('gdal_translate', '-of', 'GTiff', *(creation_options + ['-co', 'COPY_SRC_OVERVIEWS=YES', tiled, cog]))
+        size = os.path.getsize(cog)
+        with open(cog, 'rb') as f:
+            name = storage.save(instance.cog.field.generate_filename(instance, instance.file.name), File(f))
+    seconds = time.time() - start
+
+    # update() rather than save(): the record itself hasn't changed, and save() would bump last_modified
+    previous = instance.cog.name
+    Georef.objects.filter(pk=instance.pk).update(cog=name, cog_size=size, cog_seconds=seconds)
+    if previous and previous != name and not shared_file_references(previous):
+        storage.delete(previous)
+    return {'file': instance.file.name, 'cog': name, 'size': size, 'seconds': round(seconds, 1),
+            'overviews': levels}
+
+
+def gdal_path(fieldfile):
+    """
+    A path GDAL can open without copying the file: local storage directly, otherwise over HTTP range requests
+    (/vsicurl/), so only the headers needed for the extent are read. Zipped shapefiles are read through /vsizip/.
+    """
+    try:
+        path = fieldfile.storage.path(fieldfile.name)
+    except NotImplementedError:
+        path = '/vsicurl/%s' % fieldfile.storage.url(fieldfile.name)
+    if fieldfile.name.lower().endswith('.zip'):
+        path = '/vsizip/%s' % path
+    return path
+
+
+def densified_ring(corners):
+    # Straight edges in the file's projection are curves in WGS84, so each edge gets intermediate points
+    ring = []
+    for (x0, y0), (x1, y1) in zip(corners, corners[1:] + corners[:1]):
+        for i in range(FOOTPRINT_EDGE_POINTS):
+            f = i / float(FOOTPRINT_EDGE_POINTS)
+            ring.append((x0 + (x1 - x0) * f, y0 + (y1 - y0) * f))
+    ring.append(ring[0])
+    return ring
+
+
+def wgs84_polygon(corners, srs):
+    polygon = OGRGeometry('POLYGON((%s))' % ', '.join('%r %r' % point for point in densified_ring(corners)), srs)
+    polygon.transform(4326)
+    return polygon.geos
+
+
+def raster_corners(raster):
+    # geotransform maps pixel/line to georeferenced x/y, including any rotation
+    gt = raster.geotransform
+    return [(gt[0] + px * gt[1] + py * gt[2], gt[3] + px * gt[4] + py * gt[5])
+            for px, py in ((0, 0), (raster.width, 0), (raster.width, raster.height), (0, raster.height))]
+
+
+def envelope_corners(extent):
+    return [(extent.min_x, extent.min_y), (extent.max_x, extent.min_y), (extent.max_x, extent.max_y),
+            (extent.min_x, extent.max_y)]
+
+
+@task_handler('footprint')
+def footprint(task):
+    """WGS84 footprint of a Georef raster or Feature file, from its bounds and spatial reference."""
+    instance = task.get_object()
+    if instance is None or not instance.file:
+        return {'skipped': 'no file'}
+    path = gdal_path(instance.file)
+
+    if isinstance(instance, Georef):
+        raster = GDALRaster(path)
+        if raster.srs is None:
+            return {'skipped': 'no spatial reference'}
+        polygons = [wgs84_polygon(raster_corners(raster), raster.srs)]
+    else:
+        polygons = [wgs84_polygon(envelope_corners(layer.extent), layer.srs)
+                    for layer in DataSource(path) if layer.srs is not None and layer.num_feat]
+        if not polygons:
+            return {'skipped': 'no georeferenced layers'}
+
+    # A single polygon per file: the hull of all layer extents
+    outline = MultiPolygon(polygons, srid=4326).convex_hull if len(polygons) > 1 else polygons[0]
+    if outline.geom_type != 'Polygon':
+        return {'skipped': 'empty extent'}
+    # update() rather than save(), as for the COG
+    type(instance).objects.filter(pk=instance.pk).update(footprint=outline)
+    return {'file': instance.file.name, 'extent': outline.extent}
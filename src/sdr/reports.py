@@ -0,0 +1,85 @@
+from django.core.cache import cache
+from django.db import connection
+from .models import SDR_INVENTORY_CACHE_KEY
+
+# Scans, georefs and features counted as QA'd once a QA processor or QA date is recorded
+INVENTORY_SQL = """
+    WITH scans AS (
+        SELECT sdr_id, count(*) AS total,
+               count(*) FILTER (WHERE final) AS final,
+               count(*) FILTER (WHERE qa_processor_id IS NOT NULL OR qa_date IS NOT NULL) AS qa
+        FROM sdr_scan GROUP BY sdr_id
+    ), georefs AS (
+        SELECT sdr_id, count(*) AS total,
+               count(*) FILTER (WHERE final) AS final,
+               count(*) FILTER (WHERE qa_processor_id IS NOT NULL OR qa_date IS NOT NULL) AS qa
+        FROM sdr_georef GROUP BY sdr_id
+    ), features AS (
+        SELECT f.sdr_id, count(*) AS total,
+               count(*) FILTER (WHERE f.final) AS final,
+               count(*) FILTER (WHERE f.qa_processor_id IS NOT NULL OR f.qa_date IS NOT NULL) AS qa,
+               array_agg(DISTINCT ft.name ORDER BY ft.name) AS delivered
+        FROM sdr_feature f JOIN sdr_deffeaturetype ft ON ft.id = f.featuretype_id
+        GROUP BY f.sdr_id
+    ), intended AS (
+        SELECT i.sdr_id, array_agg(ft.name ORDER BY ft.name) AS intended
+        FROM sdr_sdr_intended_features i JOIN sdr_deffeaturetype ft ON ft.id = i.deffeaturetype_id
+        GROUP BY i.sdr_id
+    )
+    SELECT s.id, s.name_short, s.zotero, s.sdr_year, t.name,
+           COALESCE(sc.total, 0), COALESCE(sc.final, 0), COALESCE(sc.qa, 0),
+           COALESCE(g.total, 0), COALESCE(g.final, 0), COALESCE(g.qa, 0),
+           COALESCE(f.total, 0), COALESCE(f.final, 0), COALESCE(f.qa, 0),
+           COALESCE(i.intended, '{}'), COALESCE(f.delivered, '{}'),
+           s.last_modified
+    FROM sdr_sdr s
+    JOIN sdr_deftype t ON t.id = s.type_id
+    LEFT JOIN scans sc ON sc.sdr_id = s.id
+    LEFT JOIN georefs g ON g.sdr_id = s.id
+    LEFT JOIN features f ON f.sdr_id = s.id
+    LEFT JOIN intended i ON i.sdr_id = s.id
+    ORDER BY s.name_short, s.id
+"""
+
+INVENTORY_COLUMNS = (
+    ('id', 'ID'),
+    ('name_short', 'short name'),
+    ('zotero', 'zotero ID'),
+    ('sdr_year', 'earliest year depicted'),
+    ('type', 'resource type'),
+    ('scans', 'scans'),
+    ('scans_final', 'final scans'),
+    ('scans_qa', 'QA\'d scans'),
+    ('georefs', 'georeferenced images'),
+    ('georefs_final', 'final georeferenced images'),
+    ('georefs_qa', 'QA\'d georeferenced images'),
+    ('features', 'features'),
+    ('features_final', 'final features'),
+    ('features_qa', 'QA\'d features'),
+    ('intended', 'intended feature types'),
+    ('delivered', 'delivered feature types'),
+    ('missing', 'missing feature types'),
+    ('last_modified', 'last modified'),
+)
+
+
+def sdr_inventory():
+    """
+    Return one dict per SDR with scan/georef/feature counts split by final and QA'd, and intended vs. delivered
+    feature types. Computed in a single statement and cached until an SDR, child resource or feature type changes
+    (see the receivers in sdr.models).
+    """
+    rows = cache.get(SDR_INVENTORY_CACHE_KEY)
+    if rows is not None:
+        return rows
+
+    with connection.cursor() as cursor:
+        cursor.execute(INVENTORY_SQL)
+        rows = []
+        for values in cursor.fetchall():
+            row = dict(zip([c[0] for c in INVENTORY_COLUMNS if c[0] != 'missing'], values))
+            row['missing'] = [ft for ft in row['intended'] if ft not in row['delivered']]
+            rows.append(row)
+
+    cache.set(SDR_INVENTORY_CACHE_KEY, rows, None)
+    return rows
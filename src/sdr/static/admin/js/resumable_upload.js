@@ -0,0 +1,241 @@
+// Resumable chunked uploads for ResumableFileInput (sdr/uploads.py).
+// The selected file is sent in fixed-size chunks, each with its SHA-256, and retried on failure. The session id
+// is kept in localStorage, so selecting the same file again after a dropped connection or page reload resumes
+// from the chunks the server already has. The file input itself is cleared, so only the hidden session id is
+// posted with the form.
+(function () {
+    var MAX_RETRIES = 5;
+    var PARALLEL = 3;
+    var pending = 0;
+
+    function getCookie(name) {
+        var match = document.cookie.match(new RegExp('(^|;\\s*)' + name + '=([^;]*)'));
+        return match ? decodeURIComponent(match[2]) : null;
+    }
+
+    function request(method, url, body, headers) {
+        return new Promise(function (resolve, reject) {
+            var xhr = new XMLHttpRequest();
+            xhr.open(method, url);
+            xhr.setRequestHeader('X-CSRFToken', getCookie('csrftoken'));
+            Object.keys(headers || {}).forEach(function (h) {
+                xhr.setRequestHeader(h, headers[h]);
+            });
+            xhr.onload = function () {
+                var data = {};
+                try {
+                    data = JSON.parse(xhr.responseText);
+                } catch (e) {
+                }
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    resolve(data);
+                } else {
+                    reject(new Error(data.error || xhr.statusText || 'HTTP ' + xhr.status));
+                }
+            };
+            xhr.onerror = function () {
+                reject(new Error('network error'));
+            };
+            xhr.send(body);
+        });
+    }
+
+    var K = [
+        0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+        0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+        0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+        0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+        0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+        0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+        0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+        0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+    ];
+
+    function rotr(x, n) {
+        return (x >>> n) | (x << (32 - n));
+    }
+
+    // Plain JS SHA-256, for insecure (plain http) contexts where crypto.subtle isn't available
+    function sha256Fallback(buffer) {
+        var bytes = new Uint8Array(buffer);
+        var length = bytes.length;
+        var padded = new Uint8Array(((length + 9 + 63) >> 6) << 6);
+        padded.set(bytes);
+        padded[length] = 0x80;
+        var view = new DataView(padded.buffer);
+        view.setUint32(padded.length - 8, Math.floor(length / 0x20000000));
+        view.setUint32(padded.length - 4, (length * 8) >>> 0);
+
+        var h = [0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19];
+        var w = new Array(64);
+        for (var offset = 0; offset < padded.length; offset += 64) {
+            for (var i = 0; i < 64; i++) {
+                if (i < 16) {
+                    w[i] = view.getUint32(offset + i * 4);
+                } else {
+                    var s0 = rotr(w[i - 15], 7) ^ rotr(w[i - 15], 18) ^ (w[i - 15] >>> 3);
+                    var s1 = rotr(w[i - 2], 17) ^ rotr(w[i - 2], 19) ^ (w[i - 2] >>> 10);
+                    w[i] = (w[i - 16] + s0 + w[i - 7] + s1) | 0;
+                }
+            }
+            var a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], hh = h[7];
+            for (i = 0; i < 64; i++) {
+                var t1 = (hh + (rotr(e, 6) ^ rotr(e, 11) ^ rotr(e, 25)) + ((e & f) ^ (~e & g)) + K[i] + w[i]) | 0;
+                var t2 = ((rotr(a, 2) ^ rotr(a, 13) ^ rotr(a, 22)) + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+                hh = g;
+                g = f;
+                f = e;
+                e = (d + t1) | 0;
+                d = c;
+                c = b;
+                b = a;
+                a = (t1 + t2) | 0;
+            }
+            h = [h[0] + a, h[1] + b, h[2] + c, h[3] + d, h[4] + e, h[5] + f, h[6] + g, h[7] + hh];
+        }
+        return h.map(function (x) {
+            return ('0000000' + (x >>> 0).toString(16)).slice(-8);
+        }).join('');
+    }
+
+    function sha256(buffer) {
+        // The server requires every chunk's checksum
+        if (!window.crypto || !window.crypto.subtle) {
+            return Promise.resolve(sha256Fallback(buffer));
+        }
+        return window.crypto.subtle.digest('SHA-256', buffer).then(function (digest) {
+            return Array.prototype.map.call(new Uint8Array(digest), function (b) {
+                return ('0' + b.toString(16)).slice(-2);
+            }).join('');
+        });
+    }
+
+    function readChunk(blob) {
+        return new Promise(function (resolve, reject) {
+            var reader = new FileReader();
+            reader.onload = function () {
+                resolve(reader.result);
+            };
+            reader.onerror = reject;
+            reader.readAsArrayBuffer(blob);
+        });
+    }
+
+    function sendChunk(session, file, index, attempt) {
+        var start = index * session.chunk_size;
+        return readChunk(file.slice(start, start + session.chunk_size)).then(function (buffer) {
+            return sha256(buffer).then(function (checksum) {
+                return request('PUT', session.url + index + '/', buffer,
+                    {'Content-Type': 'application/octet-stream', 'X-Chunk-SHA256': checksum});
+            });
+        }).catch(function (err) {
+            if (attempt >= MAX_RETRIES) {
+                throw err;
+            }
+            return new Promise(function (resolve) {
+                setTimeout(resolve, 1000 * Math.pow(2, attempt));
+            }).then(function () {
+                return sendChunk(session, file, index, attempt + 1);
+            });
+        });
+    }
+
+    function startSession(createUrl, file) {
+        var key = 'resumable-upload:' + [file.name, file.size, file.lastModified].join(':');
+        var existing = window.localStorage && localStorage.getItem(key);
+        var session = existing ?
+            request('GET', createUrl + existing + '/').then(function (data) {
+                if (data.status !== 'open') {
+                    throw new Error('not resumable');
+                }
+                return data;
+            }) : Promise.reject(new Error('no session'));
+
+        return session.catch(function () {
+            return request('POST', createUrl, JSON.stringify({filename: file.name, size: file.size}),
+                {'Content-Type': 'application/json'});
+        }).then(function (data) {
+            if (window.localStorage) {
+                localStorage.setItem(key, data.id);
+            }
+            data.url = createUrl + data.id + '/';
+            data.storageKey = key;
+            return data;
+        });
+    }
+
+    function upload(input) {
+        var file = input.files[0];
+        var form = input.form;
+        var hidden = form.querySelector('input[name="' + input.getAttribute('data-upload-input') + '"]');
+        var status = hidden.nextElementSibling;
+        var createUrl = input.getAttribute('data-resumable-upload');
+
+        function show(text) {
+            status.textContent = ' ' + text;
+        }
+
+        hidden.value = '';
+        pending += 1;
+        show('starting upload...');
+        return startSession(createUrl, file).then(function (session) {
+            var received = {};
+            session.received.forEach(function (i) {
+                received[i] = true;
+            });
+            var queue = [];
+            for (var i = 0; i < session.chunk_count; i++) {
+                if (!received[i]) {
+                    queue.push(i);
+                }
+            }
+            var done = session.chunk_count - queue.length;
+            show('uploading ' + file.name + ': ' + Math.round(100 * done / session.chunk_count) + '%');
+
+            function worker() {
+                if (!queue.length) {
+                    return Promise.resolve();
+                }
+                var index = queue.shift();
+                return sendChunk(session, file, index, 0).then(function () {
+                    done += 1;
+                    show('uploading ' + file.name + ': ' + Math.round(100 * done / session.chunk_count) + '%');
+                    return worker();
+                });
+            }
+
+            var workers = [];
+            for (var w = 0; w < PARALLEL; w++) {
+                workers.push(worker());
+            }
+            return Promise.all(workers).then(function () {
+                return request('POST', session.url + 'complete/');
+            }).then(function () {
+                if (window.localStorage) {
+                    localStorage.removeItem(session.storageKey);
+                }
+                hidden.value = session.id;
+                input.value = '';
+                show(file.name + ' uploaded; save to attach it.');
+            });
+        }).catch(function (err) {
+            show('upload failed (' + err.message + '); select the file again to resume.');
+        }).then(function () {
+            pending -= 1;
+        });
+    }
+
+    document.addEventListener('change', function (e) {
+        var input = e.target;
+        if (input.hasAttribute && input.hasAttribute('data-resumable-upload') && input.files && input.files.length) {
+            upload(input);
+        }
+    });
+
+    document.addEventListener('submit', function (e) {
+        if (pending > 0) {
+            e.preventDefault();
+            alert('Please wait for file uploads to finish before saving.');
+        }
+    }, true);
+})();
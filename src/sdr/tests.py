@@ -0,0 +1,105 @@
+import shutil
+import tempfile
+from django.contrib.auth.models import User, Permission
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from .models import (Sdr, Scan, Georef, Feature, DefType, DefAccuracyLocation, DefAccuracySize, DefAccuracyGeoref,
+                     DefResolution, DefRectification, DefFeatureType, sdrfile_name, sdrfile_unchanged)
+
+
+class SdrFilesTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, SDR_CONTENT_ADDRESSED_STORAGE=False)
+        self.settings_override.enable()
+
+        user = User.objects.create(username='processor')
+        self.sdr = Sdr.objects.create(
+            zotero='ABCD1234', name_short='Old name', sdr_year=1800, type=DefType.objects.create(name='map'),
+            sdraccloc=DefAccuracyLocation.objects.create(name='good'),
+            sdraccsiz=DefAccuracySize.objects.create(name='good'),
+            sdraccgeo=DefAccuracyGeoref.objects.create(name='good'))
+        Scan.objects.create(sdr=self.sdr, file=ContentFile(b'scan', name='scan.tif'), processor=user,
+                            resolution=DefResolution.objects.create(name='600 dpi'))
+        Georef.objects.create(sdr=self.sdr, file=ContentFile(b'georef', name='georef.tif'), processor=user,
+                              rectification=DefRectification.objects.create(name='polynomial'), control_points=10,
+                              rms_error=1)
+        Feature.objects.create(sdr=self.sdr, file=ContentFile(b'feature', name='feature.zip'), processor=user,
+                               featuretype=DefFeatureType.objects.create(name='streams'))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+
+class RenameSdrWithInlinesTest(SdrFilesTestCase):
+    def test_inlines_saved_after_rename_keep_new_names(self):
+        # What the admin does: the inline formsets load the children, the SDR is saved (renaming their files),
+        # then each child form saves the instance it loaded before the rename
+        sdr = Sdr.objects.get(pk=self.sdr.pk)
+        children = list(sdr.scan_set.all()) + list(sdr.georef_set.all()) + list(sdr.feature_set.all())
+        sdr.name_short = 'New name'
+        sdr.save()
+        self.assertEqual(sdr.renamed_files, 3)
+        for child in children:
+            child.sdr = sdr
+            child.notes = 'edited'
+            child.save()
+
+        for model in (Scan, Georef, Feature):
+            for child in model.objects.filter(sdr=sdr):
+                self.assertIn('New_name', child.file.name)
+                self.assertEqual(child.file.name, sdrfile_name(child, child.file.name))
+                self.assertTrue(default_storage.exists(child.file.name), child.file.name)
+
+
+class SaveWithoutFileChangeTest(SdrFilesTestCase):
+    def test_unchanged_check_makes_no_queries(self):
+        for model in (Scan, Georef, Feature):
+            child = model.objects.get(sdr=self.sdr)
+            with self.assertNumQueries(0):
+                self.assertTrue(sdrfile_unchanged(child))
+
+    def test_save_is_a_single_update(self):
+        for model in (Scan, Georef, Feature):
+            child = model.objects.get(sdr=self.sdr)
+            child.notes = 'edited'
+            with CaptureQueriesContext(connection) as queries:
+                child.save()
+            # signal receivers may touch the cache and export tables, but nothing else about the SDR files
+            sdr_queries = [q['sql'] for q in queries.captured_queries
+                           if '"sdr_' in q['sql'] and '"sdr_cache"' not in q['sql']]
+            self.assertEqual(len(sdr_queries), 1, sdr_queries)
+            self.assertTrue(sdr_queries[0].startswith('UPDATE'), sdr_queries)
+
+    def test_renamed_sdr_on_the_instance_is_noticed_without_queries(self):
+        sdr = Sdr.objects.get(pk=self.sdr.pk)
+        child = sdr.scan_set.get()
+        sdr.name_short = 'New name'
+        with self.assertNumQueries(0):
+            self.assertFalse(sdrfile_unchanged(child))
+
+
+class AdminViewPermissionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='staff', is_staff=True)
+        self.client.force_login(self.user)
+
+    def grant_change_sdr(self):
+        self.user.user_permissions.add(Permission.objects.get(codename='change_sdr'))
+
+    def test_coverage_needs_sdr_change_permission(self):
+        url = '%s?point=-73.97,40.78' % reverse('admin:sdr_sdr_coverage')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.grant_change_sdr()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_inventory_needs_sdr_change_permission(self):
+        url = reverse('admin:sdr_sdr_inventory')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.grant_change_sdr()
+        self.assertEqual(self.client.get(url).status_code, 200)
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+from django import forms
+from django.conf import settings
+from django.conf.urls import url
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.admin.widgets import AdminFileWidget
+from django.core.exceptions import ValidationError
+from django.core.urlresolvers import reverse
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+from django.utils.text import get_valid_filename
+from django.views.decorators.http import require_http_methods, require_POST
+from app.media import media_url
+from .models import UploadSession
+
+READ_SIZE = 64 * 1024
+
+
+def _session(request, pk):
+    return get_object_or_404(UploadSession, pk=pk, created_by=request.user)
+
+
+@staff_member_required
+@require_POST
+def create_upload(request):
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+        filename = get_valid_filename(os.path.basename(data['filename']))
+        size = int(data['size'])
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'filename and size are required'}, status=400)
+    if not filename or not 0 < size <= settings.RESUMABLE_UPLOAD_MAX_SIZE:
+        return JsonResponse({'error': 'invalid filename or size'}, status=400)
+
+    session = UploadSession.start(request.user, filename, size)
+    return JsonResponse(session.as_json(), status=201)
+
+
+@staff_member_required
+@require_http_methods(['GET', 'DELETE'])
+def upload_status(request, pk):
+    session = _session(request, pk)
+    if request.method == 'DELETE' and session.status != UploadSession.ABORTED:
+        session.abort()
+    return JsonResponse(session.as_json())
+
+
+@staff_member_required
+@require_http_methods(['PUT'])
+def upload_chunk(request, pk, index):
+    session = _session(request, pk)
+    if session.status != UploadSession.OPEN:
+        return JsonResponse({'error': 'upload is %s' % session.status}, status=409)
+    index = int(index)
+    try:
+        expected = session.chunk_length(index)
+    except IndexError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Read the raw body in pieces: request.body would enforce DATA_UPLOAD_MAX_MEMORY_SIZE, and a chunk is bounded
+    # by chunk_size anyway
+    data = bytearray()
+    while len(data) <= expected:
+        piece = request.read(READ_SIZE)
+        if not piece:
+            break
+        data.extend(piece)
+    if len(data) != expected:
+        return JsonResponse({'error': 'chunk %s should be %s bytes, got %s' % (index, expected, len(data))},
+                            status=400)
+
+    checksum = request.META.get('HTTP_X_CHUNK_SHA256', '').lower()
+    if not checksum:
+        return JsonResponse({'error': 'X-Chunk-SHA256 header is required'}, status=400)
+    if hashlib.sha256(data).hexdigest() != checksum:
+        return JsonResponse({'error': 'checksum mismatch for chunk %s' % index}, status=400)
+
+    sha256 = session.write_chunk(index, bytes(data))
+    return JsonResponse({'index': index, 'sha256': sha256})
+
+
+@staff_member_required
+@require_POST
+def complete_upload(request, pk):
+    session = _session(request, pk)
+    if session.status == UploadSession.OPEN:
+        missing = session.missing()
+        if missing:
+            return JsonResponse({'error': 'missing chunks', 'missing': missing}, status=409)
+        session.complete()
+    return JsonResponse(session.as_json())
+
+
+urlpatterns = [
+    url(r'^$', create_upload, name='upload_create'),
+    url(r'^(?P<pk>[0-9a-f-]{36})/$', upload_status, name='upload_status'),
+    url(r'^(?P<pk>[0-9a-f-]{36})/(?P<index>\d+)/$', upload_chunk, name='upload_chunk'),
+    url(r'^(?P<pk>[0-9a-f-]{36})/complete/$', complete_upload, name='upload_complete'),
+]
+
+
+class MediaLink(object):
+    def __init__(self, name):
+        self.name = name
+        self.url = media_url(name)
+
+    def __str__(self):
+        return self.name
+
+
+class ResumableFileInput(AdminFileWidget):
+    """
+    File input that sends the selected file through the resumable upload endpoints instead of the form post,
+    leaving only the completed upload session id in a hidden input.
+    """
+    class Media:
+        js = ('admin/js/resumable_upload.js',)
+
+    def upload_name(self, name):
+        return '%s_upload' % name
+
+    def get_context(self, name, value, attrs):
+        context = super(ResumableFileInput, self).get_context(name, value, attrs)
+        if context['widget']['is_initial']:
+            # the "Currently" link goes through serve_media rather than straight to storage
+            context['widget']['value'] = MediaLink(value.name)
+        return context
+
+    def render(self, name, value, attrs=None, renderer=None):
+        attrs = dict(attrs or {}, **{'data-resumable-upload': reverse('upload_create'),
+                                     'data-upload-input': self.upload_name(name)})
+        html = super(ResumableFileInput, self).render(name, value, attrs, renderer)
+        return mark_safe(html + format_html(
+            '<input type="hidden" name="{0}" value=""><span class="resumable-upload-status"></span>',
+            self.upload_name(name)))
+
+    def value_from_datadict(self, data, files, name):
+        upload = data.get(self.upload_name(name))
+        if upload:
+            return upload
+        return super(ResumableFileInput, self).value_from_datadict(data, files, name)
+
+
+class ResumableFileField(forms.FileField):
+    """
+    Accepts the id of a complete upload session belonging to user. The session is marked attached when the record
+    is saved (see UploadSession.attach), so it can't be used twice.
+    """
+    widget = ResumableFileInput
+
+    def __init__(self, user=None, *args, **kwargs):
+        self.user = user
+        super(ResumableFileField, self).__init__(*args, **kwargs)
+
+    def to_python(self, data):
+        if isinstance(data, str):
+            try:
+                session = UploadSession.objects.get(pk=data, status=UploadSession.COMPLETE, created_by=self.user)
+            except (UploadSession.DoesNotExist, ValidationError, ValueError):
+                raise ValidationError('The uploaded file could not be found; please upload it again.')
+            # A storage name: assigned to the model FileField as an already-committed file
+            return session.name
+        return super(ResumableFileField, self).to_python(data)
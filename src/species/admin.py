@@ -1,6 +1,12 @@
+from django.conf.urls import url
+from django.db.models import Count
 from django.forms import ModelForm
+from django.http import Http404, JsonResponse
+from django.template.response import TemplateResponse
+from django.utils.text import slugify
 from app.utils import *
 from .models import *
+from .exports import export_parquet
 
 
 @admin.register(Taxon)
@@ -34,7 +40,8 @@ class SpeciesAdmin(SdrBaseAdmin, SpeciesReferenceMixin):
     list_display = ('name_accepted', 'common_name', 'taxon', 'col_link', 'last_modified', )
     list_display_links = ('name_accepted', 'common_name', )
     search_fields = ['name_accepted', 'name_common', 'name_accepted_ref', 'name_common_ref', ]
-    actions = (export_model_as_csv,)
+    actions = (export_model_as_csv, export_model_as_csv_gzip, export_model_as_zip, export_model_as_csv_background,
+               export_parquet)
     list_filter = ('historical_likelihood', 'taxon')
     form = SpeciesForm
 
@@ -73,3 +80,59 @@ class SpeciesAdmin(SdrBaseAdmin, SpeciesReferenceMixin):
         return super(SpeciesAdmin, self).change_view(
             request, object_id, form_url, extra_context=extra_context,
         )
+
+    def get_urls(self):
+        urls = [
+            url(r'^checklists/$', self.admin_site.admin_view(self.checklists_view),
+                name='species_species_checklists'),
+            url(r'^checklists/(?P<period_id>\d+)/(?P<taxon_id>\d+)\.(?P<fmt>csv|json)$',
+                self.admin_site.admin_view(self.checklist_view), name='species_species_checklist'),
+        ]
+        return urls + super(SpeciesAdmin, self).get_urls()
+
+    def checklists_view(self, request):
+        counts = {
+            (c['period'], c['taxon']): c['species_count']
+            for c in ChecklistEntry.objects.values('period', 'taxon').annotate(species_count=Count('id'))
+        }
+        taxa = list(Taxon.objects.all())
+        matrix = [(p, [(t, counts.get((p.pk, t.pk), 0)) for t in taxa]) for p in Period.objects.all()]
+
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Species checklists',
+            opts=self.model._meta,
+            taxa=taxa,
+            matrix=matrix,
+        )
+        return TemplateResponse(request, 'admin/species/species/checklists.html', context)
+
+    def checklist_view(self, request, period_id, taxon_id, fmt):
+        try:
+            period = Period.objects.get(pk=period_id)
+            taxon = Taxon.objects.get(pk=taxon_id)
+        except (Period.DoesNotExist, Taxon.DoesNotExist):
+            raise Http404('No such period or taxon')
+
+        entries = ChecklistEntry.objects.filter(period=period, taxon=taxon).order_by(
+            'species__name_accepted').values_list('species_id', 'species__name_accepted', 'species__name_common',
+                                                  'species__col', 'reference_count', 'reference_names')
+        columns = ('id', 'name_accepted', 'name_common', 'col', 'reference_count', 'references')
+        filename = 'checklist-%s-%s' % (slugify(period.name), slugify(taxon.name))
+
+        if fmt == 'json':
+            response = JsonResponse({
+                'period': {'id': period.pk, 'name': period.name, 'year_start': period.year_start,
+                           'year_end': period.year_end},
+                'taxon': {'id': taxon.pk, 'name': taxon.name},
+                'species': [dict(zip(columns, e)) for e in entries],
+            })
+            response['Content-Disposition'] = 'attachment; filename=%s.json' % filename
+            return response
+
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename=%s.csv' % filename
+        writer = csv.writer(response)
+        writer.writerow(columns)
+        writer.writerows(entries)
+        return response
@@ -0,0 +1,156 @@
+import io
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.db import connection
+from django.http import HttpResponse
+from app.utils import get_export_filename
+
+# Catalog of Life classification ranks flattened into their own columns
+COL_RANKS = ('kingdom', 'phylum', 'class', 'order', 'superfamily', 'family', 'genus', 'subgenus')
+
+
+def _json_array(expression):
+    # jsonb_array_elements() raises on anything that isn't an array, and col_data isn't always complete
+    return "CASE WHEN jsonb_typeof({0}) = 'array' THEN {0} ELSE '[]'::jsonb END".format(expression)
+
+
+SPECIES_COLUMNS = [
+    ('id', pa.int32(), 's.id'),
+    ('col', pa.string(), 's.col'),
+    ('name_accepted', pa.string(), 's.name_accepted'),
+    ('name_common', pa.string(), 's.name_common'),
+    ('name_accepted_ref', pa.string(), 's.name_accepted_ref'),
+    ('name_common_ref', pa.string(), 's.name_common_ref'),
+    ('taxon', pa.string(), 't.name'),
+    ('historical_likelihood', pa.string(), 'l.name'),
+    ('introduced', pa.bool_(), 's.introduced'),
+    ('composite_habitat', pa.string(), 's.composite_habitat'),
+    ('notes', pa.string(), 's.notes'),
+    ('last_modified', pa.timestamp('us', tz='UTC'), 's.last_modified'),
+    ('col_name', pa.string(), "s.col_data->>'name'"),
+    ('col_rank', pa.string(), "s.col_data->>'rank'"),
+    ('col_name_status', pa.string(), "s.col_data->>'name_status'"),
+    ('col_author', pa.string(), "s.col_data->>'author'"),
+    ('col_url', pa.string(), "s.col_data->>'url'"),
+    ('col_distribution', pa.string(), "s.col_data->>'distribution'"),
+    ('col_source_database', pa.string(), "s.col_data->>'source_database'"),
+] + [
+    ('col_%s' % rank, pa.string(),
+     "(SELECT c->>'name' FROM jsonb_array_elements({0}) c WHERE lower(c->>'rank') = '{1}' LIMIT 1)".format(
+         _json_array("s.col_data->'classification'"), rank))
+    for rank in COL_RANKS
+] + [
+    ('col_common_names', pa.list_(pa.string()),
+     "ARRAY(SELECT cn->>'name' FROM jsonb_array_elements({0}) cn)".format(
+         _json_array("s.col_data->'common_names'"))),
+    ('col_common_names_en', pa.list_(pa.string()),
+     "ARRAY(SELECT cn->>'name' FROM jsonb_array_elements({0}) cn "
+     "WHERE lower(cn->>'language') IN ('english', 'en'))".format(_json_array("s.col_data->'common_names'"))),
+]
+
+SPECIES_SQL = """
+    SELECT {columns}
+    FROM species_species s
+    JOIN species_taxon t ON t.id = s.taxon_id
+    LEFT JOIN species_likelihood l ON l.id = s.historical_likelihood_id
+    {where}
+    ORDER BY s.name_accepted
+"""
+
+SPECIESREFERENCE_COLUMNS = [
+    ('id', pa.int32(), 'sr.id'),
+    ('species_id', pa.int32(), 'sr.species_id'),
+    ('species', pa.string(), 's.name_accepted'),
+    ('reference_id', pa.int32(), 'sr.reference_id'),
+    ('reference', pa.string(), 'r.name_short'),
+    ('zotero', pa.string(), 'r.zotero'),
+    ('period_id', pa.int32(), 'sr.period_id'),
+    ('period', pa.string(), 'p.name'),
+    ('year_start', pa.int32(), 'p.year_start'),
+    ('year_end', pa.int32(), 'p.year_end'),
+    ('distribution', pa.string(), 'sr.distribution'),
+    ('pagenumbers', pa.string(), 'sr.pagenumbers'),
+    ('notes', pa.string(), 'sr.notes'),
+    ('created_by', pa.string(), 'u.username'),
+]
+
+SPECIESREFERENCE_SQL = """
+    SELECT {columns}
+    FROM species_speciesreference sr
+    JOIN species_species s ON s.id = sr.species_id
+    JOIN base_reference r ON r.id = sr.reference_id
+    JOIN base_period p ON p.id = sr.period_id
+    LEFT JOIN auth_user u ON u.id = sr.created_by_id
+    {where}
+    ORDER BY s.name_accepted, r.name_short
+"""
+
+PERIOD_COLUMNS = [
+    ('id', pa.int32(), 'p.id'),
+    ('name', pa.string(), 'p.name'),
+    ('year_start', pa.int32(), 'p.year_start'),
+    ('year_end', pa.int32(), 'p.year_end'),
+]
+
+PERIOD_SQL = """
+    SELECT {columns}
+    FROM base_period p
+    {where}
+    ORDER BY p.year_start, p.year_end, p.name
+"""
+
+
+def _arrow_table(sql, columns, where='', params=()):
+    """
+    Run one query selecting every column (JSON already flattened by PostgreSQL) and transpose the rows into typed
+    Arrow arrays.
+    """
+    query = sql.format(columns=', '.join(c[2] for c in columns), where=where)
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    arrays = [pa.array(list(v), type=c[1]) for v, c in zip(values, columns)]
+    return pa.Table.from_arrays(arrays, names=[c[0] for c in columns])
+
+
+def _scope(alias, queryset):
+    if queryset is None:
+        return '', ()
+    sql, params = queryset.values('pk').query.sql_with_params()
+    return 'WHERE %s.id IN (%s)' % (alias, sql), params
+
+
+def species_table(queryset=None):
+    where, params = _scope('s', queryset)
+    return _arrow_table(SPECIES_SQL, SPECIES_COLUMNS, where, params)
+
+
+def speciesreference_table(queryset=None):
+    where, params = _scope('sr', queryset)
+    return _arrow_table(SPECIESREFERENCE_SQL, SPECIESREFERENCE_COLUMNS, where, params)
+
+
+def period_table(queryset=None):
+    where, params = _scope('p', queryset)
+    return _arrow_table(PERIOD_SQL, PERIOD_COLUMNS, where, params)
+
+
+PARQUET_TABLES = (
+    ('species', species_table),
+    ('speciesreference', speciesreference_table),
+    ('period', period_table),
+)
+
+
+def export_parquet(modeladmin, request, queryset):
+    buf = io.BytesIO()
+    pq.write_table(species_table(queryset), buf)
+
+    response = HttpResponse(buf.getvalue(), content_type='application/octet-stream')
+    response['Content-Disposition'] = 'attachment; filename=%s' % get_export_filename(queryset, 'parquet')
+    return response
+
+
+export_parquet.short_description = 'Export selected %(verbose_name_plural)s to Parquet'
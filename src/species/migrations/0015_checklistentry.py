@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def refresh_checklists(apps, schema_editor):
+    schema_editor.execute("""
+        INSERT INTO species_checklistentry (period_id, taxon_id, species_id, reference_count, reference_names)
+        SELECT sr.period_id, s.taxon_id, sr.species_id, count(DISTINCT sr.reference_id),
+               string_agg(DISTINCT r.name_short, '; ' ORDER BY r.name_short)
+        FROM species_speciesreference sr
+        JOIN species_species s ON s.id = sr.species_id
+        JOIN base_reference r ON r.id = sr.reference_id
+        GROUP BY sr.period_id, s.taxon_id, sr.species_id
+    """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0006_auto_20181027_2141'),
+        ('species', '0014_species_composite_habitat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChecklistEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference_count', models.IntegerField(default=0)),
+                ('reference_names', models.TextField(blank=True, verbose_name='references')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.Period')),
+                ('species', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='species.Species')),
+                ('taxon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='species.Taxon')),
+            ],
+            options={
+                'verbose_name': 'checklist entry',
+                'verbose_name_plural': 'checklist entries',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='checklistentry',
+            unique_together=set([('period', 'species')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='checklistentry',
+            index_together=set([('period', 'taxon')]),
+        ),
+        migrations.RunPython(refresh_checklists, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 from django.contrib.gis.db import models
 from django.core.exceptions import ValidationError
 from django.contrib.postgres.fields import JSONField
+from django.db import connection, transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from base.models import Reference, Period
@@ -167,6 +168,12 @@ class SpeciesReference(models.Model):
     class Meta:
         ordering = ('species', 'reference',)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(SpeciesReference, cls).from_db(db, field_names, values)
+        instance._loaded_species_id = instance.species_id if 'species_id' in field_names else None
+        return instance
+
     def __str__(self):
         return '{}: {}'.format(self.species, self.reference)
 
@@ -192,3 +199,75 @@ def delete_element_reference_from_species(sender, instance, **kwargs):
             e.references.remove(ref)
     except Element.DoesNotExist:
         pass
+
+
+class ChecklistEntry(models.Model):
+    """
+    One row of the precomputed Period x Taxon x Species checklist matrix, aggregated from SpeciesReference.
+    """
+    period = models.ForeignKey(Period, on_delete=models.CASCADE)
+    taxon = models.ForeignKey(Taxon, on_delete=models.CASCADE)
+    species = models.ForeignKey(Species, on_delete=models.CASCADE)
+    reference_count = models.IntegerField(default=0)
+    reference_names = models.TextField(blank=True, verbose_name='references')
+
+    REFRESH_SQL = """
+        INSERT INTO species_checklistentry (period_id, taxon_id, species_id, reference_count, reference_names)
+        SELECT sr.period_id, s.taxon_id, sr.species_id, count(DISTINCT sr.reference_id),
+               string_agg(DISTINCT r.name_short, '; ' ORDER BY r.name_short)
+        FROM species_speciesreference sr
+        JOIN species_species s ON s.id = sr.species_id
+        JOIN base_reference r ON r.id = sr.reference_id
+        {where}
+        GROUP BY sr.period_id, s.taxon_id, sr.species_id
+    """
+
+    class Meta:
+        verbose_name = 'checklist entry'
+        verbose_name_plural = 'checklist entries'
+        unique_together = ('period', 'species')
+        index_together = ('period', 'taxon')
+
+    def __str__(self):
+        return '{}: {}'.format(self.period, self.species)
+
+    @classmethod
+    def refresh(cls, species_ids=None):
+        """
+        Rebuild the checklist rows for the given species (all species if None) in one aggregate pass.
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            if species_ids is None:
+                cursor.execute('DELETE FROM species_checklistentry')
+                cursor.execute(cls.REFRESH_SQL.format(where=''))
+            else:
+                species_ids = list(species_ids)
+                cursor.execute('DELETE FROM species_checklistentry WHERE species_id = ANY(%s)', [species_ids])
+                cursor.execute(cls.REFRESH_SQL.format(where='WHERE sr.species_id = ANY(%s)'), [species_ids])
+
+
+@receiver(post_save, sender=SpeciesReference)
+@receiver(post_delete, sender=SpeciesReference)
+def refresh_checklist_from_speciesreference(sender, instance, **kwargs):
+    # a reference moved to another species changes the checklist of the species it came from too
+    previous = getattr(instance, '_loaded_species_id', None)
+    ChecklistEntry.refresh(set(pk for pk in (instance.species_id, previous) if pk is not None))
+    instance._loaded_species_id = instance.species_id
+
+
+@receiver(post_save, sender=Reference)
+def refresh_checklist_from_reference(sender, instance, created, **kwargs):
+    # reference_names lists the references' short names. Periods are only stored by id, so editing one changes
+    # nothing here (and deleting one in use is prevented by SpeciesReference.period).
+    if not created:
+        species_ids = list(SpeciesReference.objects.filter(reference=instance).values_list(
+            'species_id', flat=True).distinct())
+        if species_ids:
+            ChecklistEntry.refresh(species_ids)
+
+
+@receiver(post_save, sender=Species)
+def refresh_checklist_from_species(sender, instance, created, **kwargs):
+    # A new species has no references yet; an edited one may have moved to another taxon
+    if not created:
+        ChecklistEntry.refresh([instance.pk])
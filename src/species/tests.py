@@ -0,0 +1,41 @@
+from django.test import TestCase
+from base.models import Reference, Period
+from .models import Taxon, Species, SpeciesReference, ChecklistEntry
+
+
+def make_species(taxon, col, name):
+    species = Species(taxon=taxon, col=col, name_accepted=name, col_data={'id': col, 'name': name})
+    species._form_cleaned = True  # don't look it up in the Catalog of Life
+    species.save()
+    return species
+
+
+class ChecklistRefreshTest(TestCase):
+    def setUp(self):
+        taxon = Taxon.objects.create(name='Birds')
+        self.robin = make_species(taxon, 'robin', 'Turdus migratorius')
+        self.jay = make_species(taxon, 'jay', 'Cyanocitta cristata')
+        self.period = Period.objects.create(name='Colonial', year_start=1609, year_end=1783)
+        self.reference = Reference.objects.create(zotero='ABCD1234', name='Field notes', name_short='Notes')
+        SpeciesReference.objects.create(species=self.robin, reference=self.reference, period=self.period)
+
+    def entries(self):
+        return dict((e.species_id, (e.reference_count, e.reference_names)) for e in ChecklistEntry.objects.all())
+
+    def test_new_reference_is_counted(self):
+        self.assertEqual(self.entries(), {self.robin.pk: (1, 'Notes')})
+
+    def test_reference_moved_to_another_species_leaves_the_first(self):
+        speciesreference = SpeciesReference.objects.get()
+        speciesreference.species = self.jay
+        speciesreference.save()
+        self.assertEqual(self.entries(), {self.jay.pk: (1, 'Notes')})
+
+    def test_deleted_reference_is_removed(self):
+        SpeciesReference.objects.get().delete()
+        self.assertEqual(self.entries(), {})
+
+    def test_renamed_reference_is_shown(self):
+        self.reference.name_short = 'Journal'
+        self.reference.save()
+        self.assertEqual(self.entries(), {self.robin.pk: (1, 'Journal')})
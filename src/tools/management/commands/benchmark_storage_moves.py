@@ -0,0 +1,44 @@
+import time
+import uuid
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from app.storage import move_files, get_mover, FAILED
+
+
+class Command(BaseCommand):
+    help = 'Time batched file moves against the configured storage (filesystem, S3, or AWS_S3_ENDPOINT_URL stand-in)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, dest='files', default=100)
+        parser.add_argument('--size', type=int, dest='size', default=1024 * 1024, help='Bytes per file')
+        parser.add_argument('--workers', type=int, dest='workers', action='append',
+                            help='Worker counts to compare; may be repeated. Default: 1 and STORAGE_MOVE_WORKERS')
+
+    def handle(self, *args, **options):
+        prefix = 'benchmark-%s' % uuid.uuid4().hex[:8]
+        workers = options.get('workers') or [1, settings.STORAGE_MOVE_WORKERS]
+        count = options.get('files')
+        content = b'\0' * options.get('size')
+        print('Storage: %s (%s)' % (default_storage.__class__.__name__, get_mover(default_storage).__name__))
+
+        names = []
+        for i in range(count):
+            names.append(default_storage.save('%s/%s.bin' % (prefix, i), ContentFile(content)))
+
+        try:
+            for w in workers:
+                moves = [(name, '%s.w%s' % (name, w)) for name in names]
+                start = time.time()
+                results = move_files(moves, workers=w)
+                elapsed = time.time() - start
+                failed = [r for r in results if r.status == FAILED]
+                print('%s workers: %s files in %.2fs (%.1f files/s), %s failed' % (
+                    w, count, elapsed, count / elapsed if elapsed else 0, len(failed)))
+                for r in failed[:5]:
+                    print('  %s: %s' % (r.old, r.error))
+                names = [r.new if r.status != FAILED else r.old for r in results]
+        finally:
+            for name in names:
+                default_storage.delete(name)
@@ -0,0 +1,149 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+import botocore
+from app.storage import list_files, delete_files, move_files, MOVED
+from exports.models import ExportJob, ExportCache
+from sdr.models import ProcessingTask, Scan, Georef, Feature, UploadSession
+from sdr.processing import derivative_root, derivative_source_root
+
+# <sdr id>-<short name>-<resource type>-<pk><ext>, as made by sdr.models.sdrfile_name. The id, type and pk survive
+# renames of the SDR, so they identify the record a file left behind by a failed rename belongs to.
+SDRFILE_PATTERN = re.compile(r'^(?P<sdr>\d+)-.*-(?P<type>[^-/]+)-(?P<pk>\d+)(?P<ext>\.[^./]*)?$')
+SDR_MODELS = (Scan, Georef, Feature)
+
+
+def sdrfile_key(name, model=None):
+    match = SDRFILE_PATTERN.match(name)
+    if match is None:
+        return None
+    kind = match.group('type') if model is None else model._meta.model_name
+    if kind not in ('scan', 'georef'):
+        kind = 'feature'  # features are named after their feature type
+    return match.group('sdr'), kind, match.group('pk'), (match.group('ext') or '').lower()
+
+
+class Command(BaseCommand):
+    help = 'Compare stored media against the database: records whose file is missing, and files nothing references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, dest='workers', default=None,
+                            help='Concurrent listing/delete/move requests. Default: STORAGE_MOVE_WORKERS')
+        parser.add_argument('--list', action='store_true', dest='list', default=False,
+                            help='Print every mismatch rather than the first few')
+        parser.add_argument('--repair', action='store_true', dest='repair', default=False,
+                            help='Move orphaned files back to records whose file is missing when the SDR id, type '
+                                 'and record id in the name match, and requeue missing COGs')
+        parser.add_argument('--delete-orphans', action='store_true', dest='delete_orphans', default=False,
+                            help='Delete files no record references (after --repair, if given)')
+        parser.add_argument('--min-age', type=float, dest='min_age', default=6,
+                            help='Hours since a file was last modified before it can count as orphaned. Default: 6')
+
+    def handle(self, *args, **options):
+        workers = options.get('workers')
+        start = time.time()
+        stored = list_files(default_storage, workers)
+        print('%s stored files listed in %.1fs' % (len(stored), time.time() - start))
+
+        referenced = set()
+        image_roots = set()
+        missing = []
+        missing_cogs = []
+        for model in SDR_MODELS:
+            for pk, name in model.objects.exclude(file='').exclude(file__isnull=True).values_list('pk', 'file'):
+                referenced.add(name)
+                if model in (Scan, Georef):
+                    image_roots.add(derivative_root(name))
+                if name not in stored:
+                    missing.append((model, pk, name))
+        for pk, name in Georef.objects.exclude(cog='').exclude(cog__isnull=True).values_list('pk', 'cog'):
+            referenced.add(name)
+            if name not in stored:
+                missing_cogs.append((pk, name))
+        for model in (ExportJob, ExportCache):
+            referenced.update(model.objects.exclude(file='').exclude(file__isnull=True).values_list('file', flat=True))
+        referenced.update(UploadSession.objects.exclude(status=UploadSession.ABORTED).values_list('name', flat=True))
+
+        # thumbnails, DZIs and tiles are named after their original rather than recorded anywhere
+        orphans = sorted(name for name in stored - referenced if derivative_source_root(name) not in image_roots)
+        # Storage is listed before the records are read, so a file whose record is still being saved (e.g. an upload
+        # moved into place in an uncommitted transaction) looks orphaned; leave recent files alone
+        recent = self.recent_files(orphans, options.get('min_age'), workers)
+        if recent:
+            print('Skipped %s unreferenced file(s) modified in the last %s hours' % (
+                len(recent), options.get('min_age')))
+            orphans = [name for name in orphans if name not in recent]
+
+        self.report('Records whose file is missing', ['%s %s: %s' % (m._meta.verbose_name, pk, n)
+                                                      for m, pk, n in missing], options)
+        self.report('Georefs whose COG is missing', ['georef %s: %s' % m for m in missing_cogs], options)
+        self.report('Files no record references', orphans, options)
+        print('Checked in %.1fs' % (time.time() - start))
+
+        if options.get('repair'):
+            orphans = self.repair(missing, missing_cogs, orphans, workers)
+        if options.get('delete_orphans') and orphans:
+            deleted = delete_files(orphans, default_storage, workers)
+            print('Deleted %s orphaned file(s)' % deleted)
+
+    def recent_files(self, names, hours, workers):
+        cutoff = timezone.now() - timedelta(hours=hours)
+
+        def recent(name):
+            try:
+                return default_storage.get_modified_time(name) > cutoff
+            except (IOError, OSError, botocore.exceptions.ClientError):
+                return False  # gone since the listing
+
+        with ThreadPoolExecutor(max_workers=workers or settings.STORAGE_MOVE_WORKERS) as executor:
+            return set(name for name, is_recent in zip(names, executor.map(recent, names)) if is_recent)
+
+    def report(self, title, lines, options):
+        print('%s: %s' % (title, len(lines)))
+        for line in lines if options.get('list') else lines[:20]:
+            print('    %s' % line)
+        if len(lines) > 20 and not options.get('list'):
+            print('    ... (--list to show all)')
+
+    def repair(self, missing, missing_cogs, orphans, workers):
+        """Returns the orphans left over."""
+        candidates = {}
+        for name in orphans:
+            if '/' not in name:
+                candidates.setdefault(sdrfile_key(name), []).append(name)
+
+        moves = []
+        records = {}
+        for model, pk, name in missing:
+            key = sdrfile_key(name, model)
+            found = candidates.get(key, []) if key is not None else []
+            # only unambiguous matches
+            if len(found) == 1:
+                moves.append((found[0], name))
+                records[name] = (model, pk)
+
+        results = move_files(moves, default_storage, workers)
+        moved = set()
+        for r in results:
+            if r.status == MOVED:
+                moved.add(r.old)
+                model, pk = records[r.new]
+                if model in (Scan, Georef):
+                    instance = model.objects.get(pk=pk)
+                    ProcessingTask.enqueue(instance, 'image_derivatives')
+                    if model is Georef:
+                        ProcessingTask.enqueue(instance, 'cog')
+            else:
+                print('Could not move %s to %s: %s' % (r.old, r.new, r.error or r.status))
+        print('Restored %s missing file(s) from orphans' % len(moved))
+
+        for pk, name in missing_cogs:
+            ProcessingTask.enqueue(Georef.objects.get(pk=pk), 'cog')
+        if missing_cogs:
+            print('Requeued %s COG(s)' % len(missing_cogs))
+        return [name for name in orphans if name not in moved]
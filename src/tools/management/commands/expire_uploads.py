@@ -0,0 +1,23 @@
+import datetime
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from sdr.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Abort resumable uploads that were abandoned or never attached, freeing storage and S3 multipart parts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, dest='days', default=2,
+                            help='Age in days since an upload was last touched')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options.get('days'))
+        stale = UploadSession.objects.filter(last_modified__lt=cutoff, status__in=(UploadSession.OPEN,
+                                                                                     UploadSession.COMPLETE))
+        for session in stale:
+            session.abort()
+            print('Aborted %s' % session)
+        # attached uploads have already been moved to their sdrfile_name, so only the rows are left to remove
+        UploadSession.objects.filter(status__in=(UploadSession.ABORTED, UploadSession.ATTACHED),
+                                     last_modified__lt=cutoff).delete()
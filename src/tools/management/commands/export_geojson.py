@@ -0,0 +1,33 @@
+import sys
+from django.core.management.base import BaseCommand
+from pn.models import PlacePoint, PlaceLine, PlacePolygon
+from pn.exports import geojson_feature_collection, ndjson_features
+
+LAYERS = {
+    'point': PlacePoint,
+    'line': PlaceLine,
+    'polygon': PlacePolygon,
+}
+
+
+class Command(BaseCommand):
+    help = 'Write all place points, lines or polygons as a GeoJSON FeatureCollection or newline-delimited GeoJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('layer', choices=sorted(LAYERS.keys()))
+        parser.add_argument('outfile', nargs='?', type=str, help='Output path; defaults to stdout')
+        parser.add_argument('--ndjson', action='store_true', dest='ndjson', default=False,
+                            help='Write one feature per line instead of a FeatureCollection')
+
+    def handle(self, *args, **options):
+        queryset = LAYERS[options.get('layer')].objects.all()
+        chunks = ndjson_features(queryset) if options.get('ndjson') else geojson_feature_collection(queryset)
+
+        outfile = options.get('outfile')
+        out = open(outfile, 'w', encoding='utf-8') if outfile else sys.stdout
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if outfile:
+                out.close()
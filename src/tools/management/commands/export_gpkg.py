@@ -0,0 +1,17 @@
+import time
+from django.core.management.base import BaseCommand
+from pn.exports import write_gazetteer_gpkg
+
+
+class Command(BaseCommand):
+    help = 'Write the whole gazetteer (places, geometries, names, locations, descriptions) to one GeoPackage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('outfile', type=str, help='Path of the .gpkg file to create')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        counts = write_gazetteer_gpkg(options.get('outfile'))
+        for table, count in sorted(counts.items()):
+            print('%s: %s rows' % (table, count))
+        print('Export complete in %.1fs' % (time.time() - start))
@@ -0,0 +1,24 @@
+import sys
+from django.core.management.base import BaseCommand
+from muirweb.exports import GRAPH_FORMATS, muirweb_graph
+
+
+class Command(BaseCommand):
+    help = 'Write the full Muir Web as GraphML, node-link JSON or a tab-separated edge list'
+
+    def add_arguments(self, parser):
+        parser.add_argument('format', choices=sorted(GRAPH_FORMATS.keys()))
+        parser.add_argument('outfile', nargs='?', type=str, help='Output path; defaults to stdout')
+
+    def handle(self, *args, **options):
+        chunks = GRAPH_FORMATS[options.get('format')][0]
+        nodes, edges = muirweb_graph()
+
+        outfile = options.get('outfile')
+        out = open(outfile, 'w', encoding='utf-8') if outfile else sys.stdout
+        try:
+            for chunk in chunks(nodes, edges):
+                out.write(chunk)
+        finally:
+            if outfile:
+                out.close()
@@ -0,0 +1,24 @@
+import os
+import pyarrow.parquet as pq
+from django.core.management.base import BaseCommand
+from species.exports import PARQUET_TABLES
+
+
+class Command(BaseCommand):
+    help = 'Write Species (with flattened Catalog of Life data), SpeciesReference and Period as Parquet files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('outdir', type=str, help='Directory to write <table>.parquet files into')
+
+    def handle(self, *args, **options):
+        outdir = options.get('outdir')
+        try:
+            os.makedirs(outdir)
+        except OSError:
+            pass  # Means it already exists.
+
+        for name, build_table in PARQUET_TABLES:
+            table = build_table()
+            path = os.path.join(outdir, '%s.parquet' % name)
+            pq.write_table(table, path)
+            print('%s: %s rows' % (path, table.num_rows))
@@ -0,0 +1,45 @@
+import time
+import traceback
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from exports.models import ExportJob
+
+
+class Command(BaseCommand):
+    help = 'Run queued admin export jobs, polling the database for new ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, dest='interval', default=5,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--once', action='store_true', dest='once', default=False,
+                            help='Exit once the queue is empty instead of polling')
+
+    def handle(self, *args, **options):
+        while True:
+            job = self._claim()
+            if job is None:
+                if options.get('once'):
+                    return
+                time.sleep(options.get('interval'))
+                continue
+
+            print('Running %s' % job)
+            try:
+                job.run()
+                print('Finished %s: %s rows' % (job, job.row_count))
+            except Exception:
+                job.status = ExportJob.FAILED
+                job.error = traceback.format_exc()
+                job.finished = timezone.now()
+                job.save()
+                print('FAILED %s' % job)
+
+    def _claim(self):
+        with transaction.atomic():
+            job = ExportJob.claim_next()
+            if job is not None:
+                job.status = ExportJob.RUNNING
+                job.started = timezone.now()
+                job.save()
+        return job
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from app.storage import content_hash
+from sdr.models import Scan, Georef, Feature
+
+
+class Command(BaseCommand):
+    help = 'Compute content hashes for SDR files stored before hashing was added, and report duplicated files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--report', action='store_true', dest='report', default=False,
+                            help='Only list files whose content is stored more than once')
+
+    def handle(self, *args, **options):
+        models = (Scan, Georef, Feature)
+        if not options.get('report'):
+            for model in models:
+                for obj in model.objects.filter(content_hash='').exclude(file='').exclude(file__isnull=True).iterator():
+                    try:
+                        digest = content_hash(obj.file)
+                    except (IOError, OSError) as e:
+                        print('%s %s: %s' % (model._meta.verbose_name, obj.pk, e))
+                        continue
+                    # update() rather than save(): nothing else about the record changes
+                    model.objects.filter(pk=obj.pk).update(content_hash=digest)
+
+        hashes = {}
+        for model in models:
+            for digest, file in model.objects.exclude(content_hash='').values_list('content_hash', 'file'):
+                hashes.setdefault(digest, set()).add('%s: %s' % (model._meta.verbose_name, file))
+        for digest, files in sorted(hashes.items()):
+            if len(files) > 1:
+                print(digest)
+                for f in sorted(files):
+                    print('    %s' % f)
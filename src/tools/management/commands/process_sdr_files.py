@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+import traceback
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from sdr.models import ProcessingTask, Scan, Georef, Feature
+from sdr.processing import TASK_HANDLERS, thumbnail_name
+
+logger = logging.getLogger('sdr.processing')
+
+
+class Command(BaseCommand):
+    help = 'Run queued SDR file processing tasks (thumbnails, tile pyramids, ...) on a pool of worker threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, dest='workers', default=2)
+        parser.add_argument('--interval', type=float, dest='interval', default=5,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--once', action='store_true', dest='once', default=False,
+                            help='Exit once the queue is empty instead of polling')
+        parser.add_argument('--enqueue-missing', action='store_true', dest='enqueue_missing', default=False,
+                            help='First queue derivatives for scans and georefs that have no thumbnail, COG or '
+                                 'footprint, and footprints for features')
+
+    def handle(self, *args, **options):
+        if options.get('enqueue_missing'):
+            self.enqueue_missing()
+
+        threads = [threading.Thread(target=self.work, args=(options,)) for i in range(options.get('workers'))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def enqueue_missing(self):
+        queued = 0
+        for model in (Scan, Georef):
+            for obj in model.objects.exclude(file='').exclude(file__isnull=True).iterator():
+                if not obj.file.storage.exists(thumbnail_name(obj.file.name)):
+                    ProcessingTask.enqueue(obj, 'image_derivatives')
+                    queued += 1
+        for obj in Georef.objects.exclude(file='').exclude(file__isnull=True).filter(cog__isnull=True).iterator():
+            ProcessingTask.enqueue(obj, 'cog')
+            queued += 1
+        for model in (Georef, Feature):
+            missing = model.objects.exclude(file='').exclude(file__isnull=True).filter(footprint__isnull=True)
+            for obj in missing.iterator():
+                ProcessingTask.enqueue(obj, 'footprint')
+                queued += 1
+        logger.info('Queued %s task(s)', queued)
+
+    def work(self, options):
+        try:
+            while True:
+                task = self._claim()
+                if task is None:
+                    if options.get('once'):
+                        return
+                    time.sleep(options.get('interval'))
+                    continue
+
+                logger.info('Running %s', task)
+                try:
+                    if task.task not in TASK_HANDLERS:
+                        raise KeyError('No handler registered for task %s' % task.task)
+                    task.run()
+                    logger.info('Finished %s: %s', task, task.result)
+                except Exception:
+                    task.status = ProcessingTask.FAILED
+                    task.error = traceback.format_exc()
+                    task.finished = timezone.now()
+                    task.save()
+                    logger.exception('Failed %s', task)
+        finally:
+            # each thread has its own connection
+            connection.close()
+
+    def _claim(self):
+        with transaction.atomic():
+            task = ProcessingTask.claim_next()
+            if task is not None:
+                task.status = ProcessingTask.RUNNING
+                task.started = timezone.now()
+                task.save()
+        return task
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from species.models import ChecklistEntry
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed species checklists from species references'
+
+    def handle(self, *args, **options):
+        ChecklistEntry.refresh()
+        print('Checklist entries: %s' % ChecklistEntry.objects.count())
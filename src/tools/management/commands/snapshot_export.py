@@ -0,0 +1,120 @@
+import datetime
+import multiprocessing
+import os
+import time
+import psycopg2
+from psycopg2 import sql
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+SNAPSHOT_APPS = ('base', 'sdr', 'pn', 'species', 'muirweb')
+
+
+def _connect(params):
+    conn = psycopg2.connect(**params)
+    conn.autocommit = True  # transactions below are opened explicitly so the snapshot is set first
+    return conn
+
+
+def _export_table(task):
+    """
+    Worker: import the leader's snapshot into a new REPEATABLE READ transaction and COPY one table out of it.
+    """
+    params, snapshot, table, outdir, output_format = task
+    start = time.time()
+    path = os.path.join(outdir, '%s.csv' % table)
+    conn = _connect(params)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY')
+            cursor.execute('SET TRANSACTION SNAPSHOT %s', (snapshot,))
+            copy = sql.SQL('COPY (SELECT * FROM {} ORDER BY 1) TO STDOUT WITH CSV HEADER').format(
+                sql.Identifier(table))
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                cursor.copy_expert(copy.as_string(conn), f)
+            cursor.execute('COMMIT')
+    finally:
+        conn.close()
+
+    if output_format == 'parquet':
+        parquet_path = os.path.join(outdir, '%s.parquet' % table)
+        pq.write_table(pacsv.read_csv(path), parquet_path)
+        os.remove(path)
+        path = parquet_path
+
+    return table, path, time.time() - start
+
+
+class Command(BaseCommand):
+    help = 'Export every table of the sdr, pn, species, muirweb and base apps from one consistent snapshot, ' \
+           'in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('outdir', nargs='?', type=str,
+                            default=os.path.join(os.path.sep, 'tmp', 'sdr', 'snapshot_%s' % (
+                                datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))))
+        parser.add_argument('--format', choices=('csv', 'parquet'), dest='format', default='csv')
+        parser.add_argument('--workers', type=int, dest='workers', default=multiprocessing.cpu_count(),
+                            help='Number of worker processes (one database connection each)')
+
+    def handle(self, *args, **options):
+        outdir = options.get('outdir')
+        try:
+            os.makedirs(outdir)
+        except OSError:
+            pass  # Means it already exists.
+
+        db = settings.DATABASES['default']
+        params = {
+            'dbname': db['NAME'],
+            'user': db['USER'],
+            'password': db['PASSWORD'],
+            'host': db['HOST'],
+            'port': db['PORT'],
+            'sslmode': db.get('OPTIONS', {}).get('sslmode', 'disable'),
+        }
+
+        tables = []
+        for label in SNAPSHOT_APPS:
+            for model in apps.get_app_config(label).get_models(include_auto_created=True):
+                if model._meta.managed and not model._meta.proxy:
+                    tables.append(model._meta.db_table)
+
+        # Don't let forked workers inherit Django's connection
+        connection.close()
+
+        start = time.time()
+        leader = _connect(params)
+        try:
+            with leader.cursor() as cursor:
+                # The snapshot stays importable only while this transaction is open
+                cursor.execute('BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY')
+                cursor.execute('SELECT pg_export_snapshot()')
+                snapshot = cursor.fetchone()[0]
+
+                # Largest tables first, so total wall-clock time approaches that of the largest table
+                cursor.execute('SELECT t, pg_total_relation_size(t::regclass) FROM unnest(%s) AS t', (tables,))
+                sizes = dict(cursor.fetchall())
+                tables.sort(key=lambda t: sizes.get(t, 0), reverse=True)
+                print('Snapshot %s: exporting %s tables to %s' % (snapshot, len(tables), outdir))
+
+                tasks = [(params, snapshot, table, outdir, options.get('format')) for table in tables]
+                pool = multiprocessing.Pool(processes=max(1, options.get('workers')))
+                try:
+                    slowest = 0
+                    for table, path, seconds in pool.imap_unordered(_export_table, tasks):
+                        slowest = max(slowest, seconds)
+                        print('%s: %.1fs' % (path, seconds))
+                finally:
+                    pool.close()
+                    pool.join()
+
+                cursor.execute('COMMIT')
+        finally:
+            leader.close()
+
+        print('Snapshot export complete in %.1fs (slowest table %.1fs)' % (time.time() - start, slowest))
@@ -0,0 +1,37 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+
+class CheckMediaOrphansTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.name = default_storage.save('orphan.txt', ContentFile(b'nothing references this'))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def delete_orphans(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('check_media', delete_orphans=True)
+
+    def test_recent_files_are_not_deleted(self):
+        # e.g. an upload moved into place by a save whose transaction hasn't committed yet
+        self.delete_orphans()
+        self.assertTrue(default_storage.exists(self.name))
+
+    def test_old_unreferenced_files_are_deleted(self):
+        old = time.time() - 7 * 3600
+        os.utime(default_storage.path(self.name), (old, old))
+        self.delete_orphans()
+        self.assertFalse(default_storage.exists(self.name))